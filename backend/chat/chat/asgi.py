@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chat.settings')
+# Preload the RAG pipeline before the server starts taking requests (see ChatApiConfig.ready)
+os.environ.setdefault('RAG_WARMUP_ON_START', '1')
 
 application = get_asgi_application()
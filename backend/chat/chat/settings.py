@@ -10,11 +10,17 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from dotenv import load_dotenv
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# API keys (OPENAI_API_KEY, TAVILY_API_KEY) and FOLDER_PDF_FILES may come from a .env file
+load_dotenv()
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/4.2/howto/deployment/checklist/
@@ -43,6 +49,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'chat_api.tracing.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -121,6 +128,11 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Uploaded PDFs
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+DOCUMENT_UPLOAD_MAX_BYTES = 200 * 1024 * 1024
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -138,4 +150,119 @@ REST_FRAMEWORK = {
 }
 
 # OpenAI settings
-OPENAI_API_KEY = 'your-api-key-here'  # Replace with your actual API key
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', 'your-api-key-here')  # Replace with your actual API key
+
+# RAG settings
+FAISS_INDEX_PATH = BASE_DIR / 'faiss_index'
+# Seconds between checks of the index files for changes made by ingestion
+FAISS_INDEX_CHECK_INTERVAL = 2.0
+# FAISS index structure built at ingestion: 'flat' (exact), 'ivf', 'hnsw', 'ivfpq', 'sq' or 'ivfsq'.
+# Changing it or its parameters takes effect with `manage.py reindex --rebuild-index`.
+FAISS_INDEX_TYPE = 'flat'
+FAISS_INDEX_PARAMS = {
+    'nlist': 1024,
+    'nprobe': 16,
+    'hnsw_m': 32,
+    'ef_construction': 200,
+    'ef_search': 64,
+    'pq_m': 64,
+    'pq_nbits': 8,
+    'sq_type': 'SQ8',
+}
+# Memory-map the vectors and read chunks from SQLite on demand when serving queries
+FAISS_INDEX_MMAP = True
+# Pickled LangChain indexes (index.pkl) are refused unless this is set
+FAISS_ALLOW_PICKLE_INDEX = False
+# Uploaded documents are indexed into one shard each under FAISS_SHARD_ROOT; at most
+# FAISS_SHARD_CACHE_SIZE shards are kept open, least recently used ones are closed.
+# Chats searching every document use one collection shard merging them all.
+FAISS_SHARD_ROOT = BASE_DIR / 'faiss_shards'
+FAISS_SHARD_CACHE_SIZE = 32
+FAISS_SHARD_INDEX_TYPE = 'flat'
+# Threads searching the shards of one query in parallel
+RAG_SHARD_SEARCH_WORKERS = 4
+# 'openai' (EMBEDDING_MODEL over the API) or 'hashing' (local CPU feature hashing, no network).
+# Indexes record the embeddings they were built with and are refused under any other;
+# switch providers with `manage.py reindex --reembed`.
+EMBEDDING_PROVIDER = 'openai'
+EMBEDDING_MODEL = 'text-embedding-ada-002'
+# Vector size of the hashing provider
+EMBEDDING_DIMENSION = 1024
+# Texts per embedding request or local batch
+EMBEDDING_BATCH_SIZE = 256
+# Embeddings are cached on disk by content hash and model, shared by ingestion and queries
+EMBEDDING_CACHE_PATH = BASE_DIR / 'embedding_cache.sqlite3'
+EMBEDDING_CACHE_MAX_ENTRIES = 500_000
+# Answers are reused for repeated questions until the index changes
+ANSWER_CACHE_MAX_ENTRIES = 1000
+ANSWER_CACHE_TTL = 3600  # seconds
+# Cosine similarity between query embeddings above which a cached answer is reused
+ANSWER_CACHE_SIMILARITY_THRESHOLD = 0.95
+# Retrieval fuses FAISS and full-text (SQLite FTS5) results by reciprocal rank;
+# one of 'hybrid', 'vector', 'lexical'. Hybrid answers exact-term lookups lexically.
+RAG_RETRIEVAL_MODE = 'hybrid'
+RAG_RETRIEVAL_K = 4
+# Candidates taken from each ranking before fusion
+RAG_RETRIEVAL_FETCH_K = 20
+RAG_RRF_K = 60
+# Post-retrieval stage: RAG_RERANK_CANDIDATES chunks are reranked locally (BM25 blended
+# with retrieval rank), RAG_RETRIEVAL_K of them picked by MMR, and trimmed to the
+# sentences mentioning the query to fit RAG_CONTEXT_TOKEN_BUDGET prompt tokens.
+RAG_RERANK = True
+RAG_RERANK_CANDIDATES = 20
+RAG_MMR_LAMBDA = 0.7  # 1.0 ignores redundancy between chunks
+RAG_CONTEXT_TOKEN_BUDGET = 1000
+# Web search used by the agent: 'tavily', or 'stub' for offline runs and tests.
+# Results are cached on disk by normalized query; after WEB_SEARCH_FAILURE_THRESHOLD
+# consecutive failures or timeouts, search is skipped for WEB_SEARCH_COOLDOWN seconds.
+WEB_SEARCH_BACKEND = 'tavily'
+WEB_SEARCH_MAX_RESULTS = 2
+WEB_SEARCH_TIMEOUT = 8.0  # seconds per call
+WEB_SEARCH_CACHE_PATH = BASE_DIR / 'web_search_cache.sqlite3'
+WEB_SEARCH_CACHE_TTL = 6 * 3600
+WEB_SEARCH_FAILURE_THRESHOLD = 3
+WEB_SEARCH_COOLDOWN = 60.0
+# Chunking for both the PDF folder and uploaded documents: chunk sizes are in tokens,
+# repeated page headers/footers are stripped, and chunks at least CHUNK_DEDUP_THRESHOLD
+# similar (MinHash Jaccard estimate) to an earlier chunk of the same document are dropped.
+CHUNK_TOKENS = 256
+CHUNK_OVERLAP_TOKENS = 32
+CHUNK_DEDUP_THRESHOLD = 0.9  # 0 or None keeps near-duplicates
+# Documents are split, embedded and indexed by background ingestion jobs. Chunks are
+# embedded DOCUMENT_INGESTION_BATCH_SIZE at a time and each batch is checkpointed, so
+# `manage.py run_ingestion` resumes an interrupted job after its last finished batch.
+DOCUMENT_INGESTION_WORKERS = 2
+DOCUMENT_INGESTION_BATCH_SIZE = 64
+DOCUMENT_INGESTION_RETRIES = 3  # per batch, with exponential backoff
+DOCUMENT_INGESTION_RETRY_DELAY = 1.0  # seconds before the first retry
+DOCUMENT_INGESTION_STALE_AFTER = 300.0  # seconds without a checkpoint before a job whose worker is gone is resumed
+# Set to False when jobs are drained by `manage.py run_ingestion --loop` instead
+DOCUMENT_INGESTION_IN_PROCESS = True
+# The async send_message path retrieves documents for each question while the agent starts;
+# set this to also start a (paid) web search for it, which is wasted when the agent never asks
+RAG_PREFETCH_WEB_SEARCH = False
+# Answers are evaluated by GPT-4 in a background worker pool; sample rate is 0.0-1.0
+EVALUATION_SAMPLE_RATE = 1.0
+EVALUATION_WORKERS = 2
+EVALUATION_MAX_ATTEMPTS = 3
+# Set to False when evaluations are drained by `manage.py run_evaluations --loop` instead
+EVALUATION_IN_PROCESS = True
+# Conversation memory: recent turns are kept verbatim up to this many tokens,
+# older ones are folded into a rolling per-chat summary
+MEMORY_MAX_TOKENS = 2000
+MEMORY_SUMMARY_MODEL = 'gpt-3.5-turbo'
+MEMORY_MAX_UNSUMMARIZED_MESSAGES = 200
+# Load the RAG pipeline, the library index, open document shards and API clients when
+# a worker starts instead of on its first request; wsgi.py and asgi.py turn this on,
+# management commands leave it off (run `manage.py warmup` to time it).
+RAG_WARMUP_ON_START = os.getenv('RAG_WARMUP_ON_START') == '1'
+# Every chat model call in the process shares LLM_MAX_CONCURRENT_CALLS slots; up to
+# LLM_MAX_WAITING_CALLS more queue for one, and beyond that calls are refused at once.
+# A request gives its LLM calls LLM_REQUEST_DEADLINE seconds in total and is answered
+# 503 with Retry-After when they run out; identical prompts in flight are sent once.
+LLM_MAX_CONCURRENT_CALLS = 8
+LLM_MAX_WAITING_CALLS = 64
+LLM_QUEUE_TIMEOUT = 30.0  # seconds a call made outside a request may wait for a slot
+LLM_REQUEST_DEADLINE = 60.0
+LLM_CALL_TIMEOUT = 60.0  # seconds per OpenAI request
+LLM_COALESCE = True
@@ -17,15 +17,18 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from chat_api.views import DocumentViewSet, ChatViewSet
+from chat_api.views import DocumentViewSet, IngestionJobViewSet, ChatViewSet, send_message_async, metrics
 
 # Create a router and register our viewsets with it.
 router = DefaultRouter()
 router.register(r'documents', DocumentViewSet)
+router.register(r'ingestion-jobs', IngestionJobViewSet)
 router.register(r'chats', ChatViewSet)
 
 # The API URLs are now determined automatically by the router.
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include(router.urls)),
+    path('api/chats/<int:pk>/send_message_async/', send_message_async, name='chat-send-message-async'),
+    path('metrics', metrics, name='metrics'),
 ]
@@ -0,0 +1,147 @@
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from .embeddings import get_embeddings
+from .engine import get_index_path, index_signature
+from .llm import SingleFlight
+from .shards import shard_generation
+
+logger = logging.getLogger(__name__)
+
+# Reported for an answer shared with an identical question that was being answered at the same time
+IN_FLIGHT_MATCH = {"match": "in_flight", "similarity": 1.0}
+
+
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", re.sub(r"[^\w\s]", "", query.lower())).strip()
+
+
+class CacheEntry:
+    def __init__(self, result: Any, vector: np.ndarray, generation):
+        self.result = result
+        self.vector = vector
+        self.generation = generation
+        self.created_at = time.monotonic()
+
+
+class AnswerCache:
+    """Per-process cache of RAG answers, matched by normalized text or query embedding.
+
+    Every entry remembers the index generation it was answered against; once the
+    library index or any document shard on disk changes (a document upload, edit
+    or deletion, a reindex) those entries are dropped.
+    Misses for the same question at the same time are coalesced through ``flight``.
+    """
+
+    def __init__(self, embeddings, max_entries: int = 1000, ttl: float = 3600.0,
+                 similarity_threshold: float = 0.95):
+        self.embeddings = embeddings
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._invalidations = 0
+        self.flight = SingleFlight()
+
+    def _generation(self):
+        # Document shards may be written by other processes (ingestion workers, other web workers)
+        return self._invalidations, index_signature(get_index_path()), shard_generation()
+
+    def _embed(self, query: str) -> np.ndarray:
+        vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _purge(self, generation):
+        now = time.monotonic()
+        stale = [
+            key for key, entry in self._entries.items()
+            if entry.generation != generation or now - entry.created_at > self.ttl
+        ]
+        for key in stale:
+            del self._entries[key]
+
+    def lookup(self, query: str) -> Tuple[Optional[Any], Optional[dict]]:
+        """Return ``(result, match)`` for a cached answer, ``(None, None)`` on a miss."""
+        key = normalize_query(query)
+        generation = self._generation()
+        with self._lock:
+            self._purge(generation)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.result, {"match": "exact", "similarity": 1.0}
+            candidates = list(self._entries.items())
+
+        if not candidates or self.similarity_threshold > 1:
+            with self._lock:
+                self.misses += 1
+            return None, None
+
+        vector = self._embed(query)
+        similarities = np.stack([entry.vector for _, entry in candidates]) @ vector
+        best = int(np.argmax(similarities))
+        with self._lock:
+            if similarities[best] >= self.similarity_threshold:
+                best_key, best_entry = candidates[best]
+                if best_key in self._entries:
+                    self._entries.move_to_end(best_key)
+                self.hits += 1
+                return best_entry.result, {"match": "semantic", "similarity": float(similarities[best])}
+            self.misses += 1
+        return None, None
+
+    def store(self, query: str, result: Any):
+        key = normalize_query(query)
+        vector = self._embed(query)
+        generation = self._generation()
+        with self._lock:
+            self._entries[key] = CacheEntry(result, vector, generation)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            self._invalidations += 1
+            self._entries.clear()
+        logger.info("Answer cache invalidated")
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._entries),
+            "coalesced": self.flight.coalesced,
+        }
+
+
+_answer_cache: Optional[AnswerCache] = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> AnswerCache:
+    global _answer_cache
+    if _answer_cache is None:
+        with _answer_cache_lock:
+            if _answer_cache is None:
+                _answer_cache = AnswerCache(
+                    get_embeddings(),
+                    max_entries=getattr(settings, "ANSWER_CACHE_MAX_ENTRIES", 1000),
+                    ttl=getattr(settings, "ANSWER_CACHE_TTL", 3600.0),
+                    similarity_threshold=getattr(settings, "ANSWER_CACHE_SIMILARITY_THRESHOLD", 0.95),
+                )
+    return _answer_cache
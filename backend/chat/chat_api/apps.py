@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ChatApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chat_api'
+
+    def ready(self):
+        # Runs before the server accepts requests, so no request pays for loading the pipeline
+        if getattr(settings, "RAG_WARMUP_ON_START", False):
+            from .warmup import warmup
+            warmup()
@@ -0,0 +1,181 @@
+import logging
+import re
+import zlib
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+from django.conf import settings
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from .tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+WORD_PATTERN = re.compile(r"\w+")
+DIGITS_PATTERN = re.compile(r"\d+")
+SPACE_PATTERN = re.compile(r"\s+")
+
+# A prime above 2**32, so (a * x) % p never overflows uint64 for 32-bit a and x
+MINHASH_PRIME = (1 << 32) + 15
+
+Page = Tuple[Optional[int], str]
+
+
+def furniture_key(line: str) -> str:
+    """Normalize a line so running headers and footers match across pages ("Page 3 of 9" == "Page 4 of 9")."""
+    return SPACE_PATTERN.sub(" ", DIGITS_PATTERN.sub("#", line.strip().lower()))
+
+
+def edge_lines(text: str, count: int, max_length: int = 100) -> List[str]:
+    """The first and last ``count`` non-empty lines of a page, skipping lines too long to be furniture."""
+    lines = [line for line in text.splitlines() if line.strip()]
+    if len(lines) > 2 * count:
+        lines = lines[:count] + lines[-count:]
+    return [line for line in lines if len(line.strip()) <= max_length]
+
+
+def find_page_furniture(pages: Iterable[str], lines_per_edge: int = 3, min_pages: int = 3,
+                        min_fraction: float = 0.5) -> Set[str]:
+    """Lines repeated at the top or bottom of most pages: running headers, footers, disclaimers.
+
+    Returns their :func:`furniture_key`; documents shorter than ``min_pages``
+    pages have none.
+    """
+    counts: Counter = Counter()
+    total = 0
+    for text in pages:
+        total += 1
+        counts.update({furniture_key(line) for line in edge_lines(text, lines_per_edge)})
+    if total < min_pages:
+        return set()
+    needed = max(min_pages, min_fraction * total)
+    return {key for key, count in counts.items() if count >= needed and key}
+
+
+class ChunkStats:
+    """What the chunking stage kept and what it saved from being embedded."""
+
+    def __init__(self):
+        self.chunks = 0
+        self.tokens = 0
+        self.duplicate_chunks = 0
+        self.furniture_lines = 0
+        self.tokens_saved = 0
+
+    def stats(self) -> Dict[str, float]:
+        total = self.tokens + self.tokens_saved
+        return {
+            "chunks": self.chunks,
+            "tokens": self.tokens,
+            "duplicate_chunks": self.duplicate_chunks,
+            "furniture_lines": self.furniture_lines,
+            "tokens_saved": self.tokens_saved,
+            "saved_ratio": self.tokens_saved / total if total else 0.0,
+        }
+
+
+class NearDuplicateFilter:
+    """Flags texts whose word shingles overlap an earlier text's by ``threshold`` (Jaccard) or more.
+
+    Each text gets a MinHash signature of ``num_perm`` values; signatures are
+    bucketed by bands (LSH), so a new text is only compared with the earlier
+    texts sharing a band with it.
+    """
+
+    def __init__(self, threshold: float = 0.9, num_perm: int = 64, bands: int = 16, shingle_size: int = 5,
+                 seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        rng = np.random.RandomState(seed)
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.bands = bands
+        self.rows = num_perm // bands
+        self._a = rng.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._signatures: List[np.ndarray] = []
+        self._buckets: Dict[Tuple[int, bytes], List[int]] = {}
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        words = WORD_PATTERN.findall(text.lower())
+        if not words:
+            return None
+        size = min(self.shingle_size, len(words))
+        shingles = {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+        hashes = np.fromiter((zlib.crc32(shingle.encode()) for shingle in shingles), dtype=np.uint64)
+        return ((np.outer(hashes, self._a) % MINHASH_PRIME + self._b) % MINHASH_PRIME).min(axis=0)
+
+    def _band_keys(self, signature: np.ndarray) -> List[Tuple[int, bytes]]:
+        return [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+
+    def is_duplicate(self, text: str) -> bool:
+        """Whether ``text`` nearly duplicates an earlier one; if not, it is remembered."""
+        signature = self.signature(text)
+        if signature is None:
+            return False
+        keys = self._band_keys(signature)
+        candidates = {index for key in keys for index in self._buckets.get(key, ())}
+        for index in candidates:
+            if np.mean(self._signatures[index] == signature) >= self.threshold:
+                return True
+        self._signatures.append(signature)
+        for key in keys:
+            self._buckets.setdefault(key, []).append(len(self._signatures) - 1)
+        return False
+
+
+class Chunker:
+    """The chunking stage shared by the PDF folder index and uploaded documents.
+
+    Chunks are sized in tokens (``CHUNK_TOKENS`` / ``CHUNK_OVERLAP_TOKENS``).
+    Page furniture is stripped before splitting, and chunks that nearly
+    duplicate an earlier chunk of the same document (``CHUNK_DEDUP_THRESHOLD``;
+    0 or None keeps them all) are dropped before they are embedded.
+    """
+
+    def __init__(self, chunk_tokens: Optional[int] = None, overlap_tokens: Optional[int] = None,
+                 dedup_threshold: Optional[float] = None):
+        self.text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_tokens or getattr(settings, "CHUNK_TOKENS", 256),
+            chunk_overlap=overlap_tokens if overlap_tokens is not None else getattr(settings, "CHUNK_OVERLAP_TOKENS", 32),
+            length_function=count_tokens,
+        )
+        if dedup_threshold is None:
+            dedup_threshold = getattr(settings, "CHUNK_DEDUP_THRESHOLD", 0.9)
+        self.dedup_threshold = dedup_threshold
+        self.stats = ChunkStats()
+
+    def strip_furniture(self, text: str, furniture: Set[str]) -> str:
+        kept = []
+        for line in text.splitlines():
+            if furniture_key(line) in furniture:
+                self.stats.furniture_lines += 1
+                self.stats.tokens_saved += count_tokens(line)
+            else:
+                kept.append(line)
+        return "\n".join(kept)
+
+    def chunk_pages(self, pages: Iterable[Page], furniture: Set[str] = frozenset()) -> Iterator[Page]:
+        """Yield ``(page, chunk)`` for one document, read one page at a time.
+
+        ``furniture`` comes from :func:`find_page_furniture` over the same pages.
+        """
+        duplicates = NearDuplicateFilter(self.dedup_threshold) if self.dedup_threshold else None
+        for page_number, text in pages:
+            if furniture:
+                text = self.strip_furniture(text, furniture)
+            for chunk in self.text_splitter.split_text(text):
+                tokens = count_tokens(chunk)
+                if duplicates is not None and duplicates.is_duplicate(chunk):
+                    self.stats.duplicate_chunks += 1
+                    self.stats.tokens_saved += tokens
+                    continue
+                self.stats.chunks += 1
+                self.stats.tokens += tokens
+                yield page_number, chunk
+
+    def chunk_document(self, pages: List[Page]) -> List[Page]:
+        """Chunk a document whose pages are all in memory."""
+        furniture = find_page_furniture(text for _, text in pages)
+        return list(self.chunk_pages(pages, furniture))
@@ -0,0 +1,156 @@
+import logging
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Set, Tuple
+
+from langchain_core.documents import Document
+
+from .lexical import tokenize
+from .tokens import count_tokens
+from .tracing import CONTEXT_TOKENS
+
+logger = logging.getLogger(__name__)
+
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it me my of on or our should that the "
+    "their there this to was we what when where which who why will with you your".split()
+)
+
+
+def terms(text: str) -> List[str]:
+    return [token for token in (t.lower() for t in tokenize(text)) if token not in STOPWORDS]
+
+
+def split_sentences(text: str) -> List[str]:
+    return [sentence.strip() for sentence in SENTENCE_PATTERN.split(text) if sentence.strip()]
+
+
+def bm25_scores(query_terms: Set[str], documents: List[List[str]], k1: float = 1.2, b: float = 0.75) -> List[float]:
+    """BM25 of each tokenized document against ``query_terms``, with IDF taken over ``documents``."""
+    count = len(documents)
+    average_length = sum(len(tokens) for tokens in documents) / count if count else 0.0
+    frequencies = [Counter(tokens) for tokens in documents]
+    document_frequency = {term: sum(1 for tf in frequencies if term in tf) for term in query_terms}
+    scores = []
+    for tokens, tf in zip(documents, frequencies):
+        norm = k1 * (1 - b + b * len(tokens) / average_length) if average_length else k1
+        score = 0.0
+        for term in query_terms:
+            if term in tf:
+                idf = math.log(1 + (count - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+                score += idf * tf[term] * (k1 + 1) / (tf[term] + norm)
+        scores.append(score)
+    return scores
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+class ContextCompressor:
+    """Reranks retrieved chunks and fits the best of them into a token budget.
+
+    Candidates are rescored by BM25 over the candidate set blended with their
+    retrieval rank, picked by maximal marginal relevance (``mmr_lambda`` trades
+    relevance against overlap with the chunks already picked), and trimmed to
+    the sentences that mention query terms. Chunks with no such sentence were
+    matched semantically and are kept whole. Everything runs locally; no model
+    is called.
+    """
+
+    def __init__(self, k: int = 4, token_budget: int = 1000, mmr_lambda: float = 0.7, lexical_weight: float = 0.5,
+                 duplicate_threshold: float = 0.9):
+        self.k = k
+        self.token_budget = token_budget
+        self.mmr_lambda = mmr_lambda
+        self.lexical_weight = lexical_weight
+        self.duplicate_threshold = duplicate_threshold
+
+    def rerank(self, query_terms: Set[str], tokens: List[List[str]]) -> List[float]:
+        """Relevance in [0, 1] of each candidate, given best-first with its tokens."""
+        bm25 = bm25_scores(query_terms, tokens)
+        top = max(bm25, default=0.0) or 1.0
+        count = len(tokens)
+        return [
+            self.lexical_weight * score / top + (1 - self.lexical_weight) * (1 - rank / count)
+            for rank, score in enumerate(bm25)
+        ]
+
+    def select(self, relevance: List[float], token_sets: List[Set[str]]) -> List[int]:
+        """Indices of up to ``k`` candidates chosen by maximal marginal relevance.
+
+        Candidates nearly identical to one already chosen are never chosen.
+        """
+        selected: List[int] = []
+        redundancy = [0.0] * len(relevance)
+        remaining = list(range(len(relevance)))
+        while remaining and len(selected) < self.k:
+            best = max(remaining, key=lambda i: self.mmr_lambda * relevance[i] - (1 - self.mmr_lambda) * redundancy[i])
+            selected.append(best)
+            remaining.remove(best)
+            for i in remaining:
+                redundancy[i] = max(redundancy[i], jaccard(token_sets[i], token_sets[best]))
+            remaining = [i for i in remaining if redundancy[i] < self.duplicate_threshold]
+        return selected
+
+    def trim(self, text: str, weights: Dict[str, float], budget: int) -> Tuple[str, int]:
+        """The sentences of ``text`` that mention query terms, best first up to ``budget`` tokens, in order."""
+        sentences = split_sentences(text)
+        scored = [
+            (sum(weights.get(term, 0.0) for term in set(terms(sentence))), i) for i, sentence in enumerate(sentences)
+        ]
+        if not any(score for score, _ in scored):
+            scored = [(1.0, i) for i in range(len(sentences))]
+        kept, used = [], 0
+        for score, i in sorted(scored, key=lambda item: (-item[0], item[1])):
+            if score <= 0:
+                break
+            tokens = count_tokens(sentences[i])
+            if used + tokens > budget:
+                continue
+            kept.append(i)
+            used += tokens
+        return " ".join(sentences[i] for i in sorted(kept)), used
+
+    def compress(self, query: str, documents: List[Document]) -> List[Document]:
+        if not documents:
+            return documents
+        query_terms = set(terms(query))
+        tokens = [terms(document.page_content) for document in documents]
+        relevance = self.rerank(query_terms, tokens)
+        selected = self.select(relevance, [set(t) for t in tokens])
+
+        # Query terms weighted by how rare they are among the candidates
+        weights = {
+            term: math.log(1 + len(tokens) / (1 + sum(1 for t in tokens if term in t))) + 1e-3
+            for term in query_terms
+        }
+        candidate_tokens = [count_tokens(document.page_content) for document in documents]
+        tokens_in = sum(candidate_tokens)
+        # What the prompt would have received without this stage: the top k as retrieved
+        baseline = sum(candidate_tokens[:self.k])
+        compressed, used = [], 0
+        for index in selected:
+            document = documents[index]
+            text, tokens_used = self.trim(document.page_content, weights, self.token_budget - used)
+            if not text:
+                continue
+            compressed.append(Document(
+                page_content=text, metadata={**document.metadata, "rerank_score": round(relevance[index], 4)}
+            ))
+            used += tokens_used
+            if used >= self.token_budget:
+                break
+
+        CONTEXT_TOKENS.observe(baseline, kind="top_k")
+        CONTEXT_TOKENS.observe(used, kind="kept")
+        logger.info(
+            f"Context for {query!r}: {len(documents)} candidates with {tokens_in} tokens "
+            f"(top {self.k}: {baseline}), kept {len(compressed)} chunks with {used} tokens "
+            f"({used / baseline if baseline else 0.0:.0%} of top {self.k})"
+        )
+        return compressed
+
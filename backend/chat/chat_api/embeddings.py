@@ -0,0 +1,227 @@
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from langchain.embeddings import OpenAIEmbeddings
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_PROVIDERS = ("openai", "hashing")
+
+
+class EmbeddingCache:
+    """On-disk embedding store keyed by content hash and embedding model.
+
+    Entries are evicted least-recently-used first once ``max_entries`` is
+    exceeded; eviction trims down to 90% of the limit so it runs rarely.
+    """
+
+    def __init__(self, path: str, max_entries: int = 500_000):
+        self.path = str(path)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self._lock:
+            # SQLite caps the number of bound parameters, so look up in slices
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                found.update((key, np.frombuffer(vector, dtype=np.float32).tolist()) for key, vector in rows)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found]
+                )
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(set(keys)) - len(found)
+        return found
+
+    def put_many(self, model: str, items: Dict[str, List[float]]):
+        now = time.time()
+        rows = [
+            (key, model, np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for key, vector in items.items()
+        ]
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, model, vector, last_used) VALUES (?, ?, ?, ?)", rows
+            )
+            self._size += self._conn.total_changes - before
+            if self._size > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        excess = self._size - int(self.max_entries * 0.9)
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN "
+            "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,)
+        )
+        self._size -= excess
+        logger.info(f"Evicted {excess} entries from the embedding cache")
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": self._size,
+            "max_entries": self.max_entries,
+        }
+
+
+class HashingEmbeddings(Embeddings):
+    """Local CPU embeddings from signed feature hashing of words and word bigrams.
+
+    No model and no network: each text becomes a sparse bag of hashed features
+    with sublinear term frequencies, L2-normalised. Texts are embedded in batches
+    of ``batch_size`` rows filled with one scatter-add each.
+    """
+
+    VERSION = "hashing-v1"
+    TOKEN_PATTERN = re.compile(r"\w+(?:[-./]\w+)*")
+
+    def __init__(self, dimension: int = 1024, batch_size: int = 256):
+        self.dimension = dimension
+        self.batch_size = batch_size
+        self.model_name = f"{self.VERSION}-{dimension}"
+        self.identity = {"provider": "hashing", "model": self.VERSION, "dimension": dimension}
+        self._bucket = lru_cache(maxsize=1 << 18)(self._hash_feature)
+
+    def _hash_feature(self, feature: str) -> Tuple[int, float]:
+        digest = zlib.crc32(feature.encode("utf-8"))
+        return digest % self.dimension, 1.0 if digest & 0x80000000 else -1.0
+
+    def _features(self, text: str) -> List[str]:
+        tokens = self.TOKEN_PATTERN.findall(text.lower())
+        return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        rows, columns, signs = [], [], []
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                column, sign = self._bucket(feature)
+                rows.append(row)
+                columns.append(column)
+                signs.append(sign)
+        matrix = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        np.add.at(matrix, (np.asarray(rows, dtype=np.intp), np.asarray(columns, dtype=np.intp)),
+                  np.asarray(signs, dtype=np.float32))
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self._embed_batch(texts[start:start + self.batch_size]).tolist())
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed_batch([text])[0].tolist()
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only sends texts missing from the cache upstream."""
+
+    def __init__(self, underlying: Embeddings, cache: EmbeddingCache, model_name: str,
+                 identity: Optional[dict] = None):
+        self.underlying = underlying
+        self.cache = cache
+        self.model_name = model_name
+        # Recorded in index metadata; indexes built with other embeddings are refused
+        self.identity = identity or getattr(underlying, "identity", None)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [EmbeddingCache.make_key(self.model_name, text) for text in texts]
+        found = self.cache.get_many(keys)
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(self.model_name, computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = EmbeddingCache.make_key(self.model_name, text)
+        found = self.cache.get_many([key])
+        if key in found:
+            return found[key]
+        vector = self.underlying.embed_query(text)
+        self.cache.put_many(self.model_name, {key: vector})
+        return vector
+
+
+def create_embeddings(provider: Optional[str] = None) -> Embeddings:
+    """Build the embeddings selected by ``EMBEDDING_PROVIDER`` (or ``provider``).
+
+    Remote providers are wrapped in the on-disk cache; the local hashing
+    provider is cheaper to recompute than to look up, so it is used directly.
+    """
+    provider = provider or getattr(settings, "EMBEDDING_PROVIDER", "openai")
+    batch_size = getattr(settings, "EMBEDDING_BATCH_SIZE", 256)
+    if provider == "hashing":
+        return HashingEmbeddings(getattr(settings, "EMBEDDING_DIMENSION", 1024), batch_size=batch_size)
+    if provider == "openai":
+        model_name = getattr(settings, "EMBEDDING_MODEL", "text-embedding-ada-002")
+        cache = EmbeddingCache(
+            getattr(settings, "EMBEDDING_CACHE_PATH", "./././embedding_cache.sqlite3"),
+            max_entries=getattr(settings, "EMBEDDING_CACHE_MAX_ENTRIES", 500_000),
+        )
+        return CachedEmbeddings(
+            OpenAIEmbeddings(model=model_name, chunk_size=batch_size), cache, model_name,
+            identity={"provider": "openai", "model": model_name},
+        )
+    raise ValueError(f"Unknown EMBEDDING_PROVIDER {provider!r}; expected one of {EMBEDDING_PROVIDERS}")
+
+
+def cache_stats(embeddings) -> Optional[dict]:
+    cache = getattr(embeddings, "cache", None)
+    return cache.stats() if cache is not None else None
+
+
+_embeddings: Optional[Embeddings] = None
+_embeddings_lock = threading.Lock()
+
+
+def get_embeddings() -> Embeddings:
+    global _embeddings
+    if _embeddings is None:
+        with _embeddings_lock:
+            if _embeddings is None:
+                _embeddings = create_embeddings()
+    return _embeddings
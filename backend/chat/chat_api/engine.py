@@ -0,0 +1,178 @@
+import logging
+import threading
+import time
+from typing import Iterable, List, Optional
+
+from django.conf import settings
+from langchain.chains import RetrievalQA
+
+from .compression import ContextCompressor
+from .embeddings import get_embeddings
+from .index_store import index_signature, read_index
+from .lexical import LexicalIndex
+from .llm import chat_model, shared
+from .retrieval import HybridRetriever, Shard, fan_out
+from .shards import ShardCache, collection_path, document_shard_path
+from .tracing import record, stage
+from .web_search import create_web_search
+
+logger = logging.getLogger(__name__)
+
+
+def get_index_path() -> str:
+    return str(getattr(settings, "FAISS_INDEX_PATH", "./././faiss_index"))
+
+
+class IndexState:
+    """The loaded library index (the PDF folder), as one shard.
+
+    A state is never mutated once published: a reload builds a new one and swaps
+    the reference, so queries holding the old state finish against it untouched.
+    """
+
+    def __init__(self, shard: Optional[Shard], signature):
+        self.shard = shard
+        self.signature = signature
+        self.loaded_at = time.time()
+
+
+def create_compressor() -> Optional[ContextCompressor]:
+    if not getattr(settings, "RAG_RERANK", True):
+        return None
+    return ContextCompressor(
+        k=getattr(settings, "RAG_RETRIEVAL_K", 4),
+        token_budget=getattr(settings, "RAG_CONTEXT_TOKEN_BUDGET", 1000),
+        mmr_lambda=getattr(settings, "RAG_MMR_LAMBDA", 0.7),
+    )
+
+
+class RetrievalEngine:
+    """Long-lived holder of the FAISS indexes, LLM and tools for one worker process.
+
+    The library index is kept loaded and reloaded in the background when it
+    changes; uploaded documents each have their own shard, opened on demand
+    through an LRU :class:`ShardCache`. Unscoped queries search the collection
+    shard, which merges every document, so they open two shards however many
+    documents there are.
+    """
+
+    def __init__(self, index_path: str, check_interval: float = 2.0, embeddings=None, llm=None,
+                 streaming_llm=None, search=None):
+        self.index_path = index_path
+        self.check_interval = check_interval
+        self.embeddings = embeddings or get_embeddings()
+        self.llm = shared(llm or chat_model("gpt-4"))
+        self.streaming_llm = shared(streaming_llm or chat_model("gpt-4", streaming=True))
+        self.search = search or create_web_search()
+        self.compressor = create_compressor()
+        self.shard_cache = ShardCache(self.embeddings, max_open=getattr(settings, "FAISS_SHARD_CACHE_SIZE", 32))
+        self._state: Optional[IndexState] = None
+        self._lock = threading.Lock()
+        self._reloading = False
+        self._last_check = 0.0
+
+    @property
+    def state(self) -> IndexState:
+        if self._state is None:
+            with self._lock:
+                if self._state is None:
+                    self._state = self._load(index_signature(self.index_path))
+        else:
+            self._check_for_changes()
+        return self._state
+
+    def reload(self) -> IndexState:
+        """Load the index from disk now, in the calling thread."""
+        with self._lock:
+            self._state = self._load(index_signature(self.index_path))
+            return self._state
+
+    def _load(self, signature) -> IndexState:
+        if signature is None:
+            logger.warning(f"No FAISS index at {self.index_path}; searching uploaded documents only")
+            return IndexState(None, None)
+        started = time.monotonic()
+        vectorstore = read_index(
+            self.index_path,
+            self.embeddings,
+            mmap=getattr(settings, "FAISS_INDEX_MMAP", True),
+            allow_pickle=getattr(settings, "FAISS_ALLOW_PICKLE_INDEX", False),
+            params=getattr(settings, "FAISS_INDEX_PARAMS", None),
+        )
+        shard = Shard(vectorstore, LexicalIndex.load(self.index_path, vectorstore))
+        record("index_load", time.monotonic() - started)
+        logger.info(f"Loaded FAISS index from {self.index_path} in {time.monotonic() - started:.2f}s")
+        return IndexState(shard, signature)
+
+    def shards(self, document_ids: Optional[Iterable[int]] = None) -> List[Shard]:
+        """The shards a query searches: the library and the collection of all documents, or only ``document_ids``."""
+        if document_ids is None:
+            shards = [] if self.state.shard is None else [self.state.shard]
+            with stage("shard_load"):
+                collection = self.shard_cache.get(collection_path())
+            return shards if collection is None else shards + [collection]
+        paths = [document_shard_path(document_id) for document_id in document_ids]
+        with stage("shard_load"):
+            return [shard for shard in fan_out(self.shard_cache.get, paths) if shard is not None]
+
+    def retriever(self, document_ids: Optional[Iterable[int]] = None) -> HybridRetriever:
+        return HybridRetriever(
+            shards=self.shards(document_ids),
+            embeddings=self.embeddings,
+            k=getattr(settings, "RAG_RETRIEVAL_K", 4),
+            fetch_k=getattr(settings, "RAG_RETRIEVAL_FETCH_K", 20),
+            rrf_k=getattr(settings, "RAG_RRF_K", 60),
+            mode=getattr(settings, "RAG_RETRIEVAL_MODE", "hybrid"),
+            compressor=self.compressor,
+            candidates=getattr(settings, "RAG_RERANK_CANDIDATES", 20),
+        )
+
+    def retrieval_qa_chain(self, document_ids: Optional[Iterable[int]] = None) -> RetrievalQA:
+        """A QA chain over :meth:`shards`; build one per query so new documents are picked up."""
+        return RetrievalQA.from_chain_type(
+            llm=self.llm,
+            retriever=self.retriever(document_ids),
+            return_source_documents=True
+        )
+
+    def _check_for_changes(self):
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        with self._lock:
+            if self._reloading or now - self._last_check < self.check_interval:
+                return
+            self._last_check = now
+            signature = index_signature(self.index_path)
+            # A missing index usually means a writer is mid-swap; keep serving the old one.
+            if signature is None or signature == self._state.signature:
+                return
+            self._reloading = True
+        threading.Thread(target=self._background_reload, args=(signature,), daemon=True).start()
+
+    def _background_reload(self, signature):
+        try:
+            state = self._load(signature)
+        except Exception as e:
+            logger.error(f"Error reloading FAISS index: {str(e)}")
+            state = None
+        with self._lock:
+            if state is not None:
+                self._state = state
+            self._reloading = False
+
+
+_engine: Optional[RetrievalEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> RetrievalEngine:
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = RetrievalEngine(
+                    get_index_path(),
+                    check_interval=getattr(settings, "FAISS_INDEX_CHECK_INTERVAL", 2.0),
+                )
+    return _engine
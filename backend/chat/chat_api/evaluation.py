@@ -0,0 +1,104 @@
+import logging
+import random
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .engine import get_engine
+from .models import MessageEvaluation
+from .rag_exp import self_evaluate
+from .tracing import stage
+
+logger = logging.getLogger(__name__)
+
+# "Score: 8", "Confidence score: 7.5/10", "confidence is 6"; not the "0-10" range of the prompt itself
+LABELLED_SCORE_PATTERN = re.compile(
+    r"\b(?:confidence|score)\b[^\d\n]{0,20}?(\d+(?:\.\d+)?)(?!\s*-\s*\d)", re.IGNORECASE
+)
+SCORE_PATTERN = re.compile(r"(\d+(?:\.\d+)?)\s*(?:/|out of)\s*10\b", re.IGNORECASE)
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def parse_confidence_score(evaluation: str) -> Optional[float]:
+    """The score on the evaluation's ``Score: N`` line, else the first "N/10"; None if there is neither.
+
+    The last labelled score wins, since the prompt asks for it at the end.
+    """
+    labelled = LABELLED_SCORE_PATTERN.findall(evaluation)
+    if labelled:
+        return min(float(labelled[-1]), 10.0)
+    match = SCORE_PATTERN.search(evaluation)
+    if match is None:
+        return None
+    return min(float(match.group(1)), 10.0)
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, "EVALUATION_WORKERS", 2),
+                    thread_name_prefix="evaluation",
+                )
+    return _executor
+
+
+def schedule_evaluation(message, query: str, sources: str) -> Optional[MessageEvaluation]:
+    """Queue a background evaluation of an assistant ``message``, subject to sampling.
+
+    The evaluation row is the queue entry: it is picked up by the in-process
+    worker pool once the surrounding transaction commits, and by
+    ``manage.py run_evaluations`` if the process dies before that.
+    """
+    if random.random() >= getattr(settings, "EVALUATION_SAMPLE_RATE", 1.0):
+        return None
+    evaluation = MessageEvaluation.objects.create(message=message, query=query, sources=sources)
+    if getattr(settings, "EVALUATION_IN_PROCESS", True):
+        transaction.on_commit(lambda: get_executor().submit(_run_in_worker, evaluation.id))
+    return evaluation
+
+
+def _run_in_worker(evaluation_id):
+    try:
+        run_evaluation(evaluation_id)
+    finally:
+        close_old_connections()
+
+
+def run_evaluation(evaluation_id) -> bool:
+    """Evaluate one queued message; returns False if it was not evaluated."""
+    claimed = MessageEvaluation.objects.filter(
+        id=evaluation_id, status=MessageEvaluation.STATUS_PENDING
+    ).update(status=MessageEvaluation.STATUS_RUNNING)
+    if not claimed:
+        return False
+
+    evaluation = MessageEvaluation.objects.select_related('message').get(id=evaluation_id)
+    evaluation.attempts += 1
+    try:
+        with stage("evaluation"):
+            text = self_evaluate(
+                get_engine().llm,
+                f"{evaluation.query}|||{evaluation.message.content}|||{evaluation.sources or 'No sources available'}"
+            )
+        evaluation.explanation = text
+        evaluation.confidence_score = parse_confidence_score(text)
+        evaluation.status = MessageEvaluation.STATUS_DONE
+        evaluation.completed_at = timezone.now()
+    except Exception as e:
+        logger.error(f"Error evaluating message {evaluation.message_id}: {str(e)}")
+        max_attempts = getattr(settings, "EVALUATION_MAX_ATTEMPTS", 3)
+        failed = evaluation.attempts >= max_attempts
+        evaluation.status = MessageEvaluation.STATUS_FAILED if failed else MessageEvaluation.STATUS_PENDING
+        evaluation.explanation = str(e)
+    evaluation.save()
+    return evaluation.status == MessageEvaluation.STATUS_DONE
@@ -1,17 +1,18 @@
+import logging
+import os
 import pathlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby, islice
 import fitz
 from typing import *
-import fitz
-from langchain.embeddings import OpenAIEmbeddings
 from langchain.vectorstores import FAISS
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.tools import Tool
-from langchain.chains import RetrievalQA
-from langchain.chat_models import ChatOpenAI
-from langchain.agents import initialize_agent, Tool, AgentType
-from langchain_community.tools.tavily_search import TavilySearchResults
-from langchain_community.chat_models import ChatOpenAI
-from langchain.memory import ConversationBufferMemory
+from langchain.schema import Document
+from .chunking import Chunker
+from .indexing import save_index
+from .embeddings import cache_stats, get_embeddings
+
+logger = logging.getLogger(__name__)
 
 
 def find_pdf_file_by_folder(folder_pdfs: str) -> List[str]:
@@ -34,13 +35,98 @@ def generate_list_texts_pdfs_files(folder_pdfs) -> List[str]:
     return text_list_files
 
 
-def convert_text_to_vec_db(folder_pdf_files: str):
-    list_of_text = generate_list_texts_pdfs_files(folder_pdf_files)
+def iter_pdf_pages(path_pdf_file: str) -> Iterator[Tuple[int, str]]:
+    with fitz.open(path_pdf_file) as doc:
+        for page_number, page in enumerate(doc, start=1):
+            yield page_number, page.get_text()
+
+
+def pdf_page_count(path_pdf_file: str) -> int:
+    with fitz.open(path_pdf_file) as doc:
+        return doc.page_count
+
+
+def extract_pdf_pages(path_pdf_file: str) -> Tuple[str, List[Tuple[int, str]]]:
+    # Runs in a worker process, so it returns plain picklable data for one file
+    return path_pdf_file, list(iter_pdf_pages(path_pdf_file))
+
+
+def iter_pages_parallel(list_pdf_files: Iterable[str], workers: Optional[int] = None,
+                        max_pending: Optional[int] = None) -> Iterator[Tuple[str, int, str]]:
+    """Yield ``(source, page_number, text)`` while a process pool extracts ahead.
+
+    At most ``max_pending`` files are extracted but not yet consumed, which keeps
+    memory bounded when embedding is slower than extraction.
+    """
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or workers * 2
+    list_pdf_files = iter(list_pdf_files)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque(executor.submit(extract_pdf_pages, path_) for path_ in islice(list_pdf_files, max_pending))
+        while pending:
+            source, pages = pending.popleft().result()
+            for path_ in islice(list_pdf_files, 1):
+                pending.append(executor.submit(extract_pdf_pages, path_))
+            for page_number, text in pages:
+                yield source, page_number, text
+
+
+def iter_chunks(pages: Iterable[Tuple[str, int, str]], chunker: Chunker) -> Iterator[Document]:
+    # Pages arrive grouped by file; each file is chunked as one document
+    for source, file_pages in groupby(pages, key=lambda page: page[0]):
+        chunk_numbers: Dict[int, int] = {}
+        for page_number, chunk in chunker.chunk_document([(page_number, text) for _, page_number, text in file_pages]):
+            chunk_number = chunk_numbers[page_number] = chunk_numbers.get(page_number, -1) + 1
+            yield Document(
+                page_content=chunk,
+                metadata={"source": source, "page": page_number, "chunk": chunk_number},
+            )
+
+
+def chunk_id(doc: Document) -> str:
+    return f"{doc.metadata['source']}#{doc.metadata['page']}-{doc.metadata['chunk']}"
+
+
+def batched(iterable: Iterable, batch_size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
+
+
+def add_pdfs_to_vectorstore(vectorstore: Optional[FAISS], list_pdf_files: Iterable[str], embeddings,
+                            batch_size: int = 256, workers: Optional[int] = None,
+                            chunker: Optional[Chunker] = None
+                            ) -> Tuple[Optional[FAISS], Dict[str, List[str]]]:
+    """Extract, chunk and embed ``list_pdf_files`` into ``vectorstore`` batch by batch.
+
+    Returns the (possibly newly created) vectorstore and the chunk ids added per
+    file; what chunking saved is in ``chunker.stats``.
+    """
+    chunker = chunker or Chunker()
+    pages = iter_pages_parallel(list_pdf_files, workers=workers)
+
+    ids_by_source = {}
+    for batch in batched(iter_chunks(pages, chunker), batch_size):
+        ids = [chunk_id(doc) for doc in batch]
+        if vectorstore is None:
+            vectorstore = FAISS.from_documents(batch, embeddings, ids=ids)
+        else:
+            vectorstore.add_documents(batch, ids=ids)
+        for doc, id_ in zip(batch, ids):
+            ids_by_source.setdefault(doc.metadata["source"], []).append(id_)
+    return vectorstore, ids_by_source
 
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-    docs = text_splitter.create_documents(list_of_text)
 
-    embeddings = OpenAIEmbeddings()
+def convert_text_to_vec_db(folder_pdf_files: str, index_path: str = "./././faiss_index",
+                           batch_size: int = 256, workers: Optional[int] = None):
+    embeddings = get_embeddings()
+    chunker = Chunker()
+    vectorstore, _ = add_pdfs_to_vectorstore(
+        None, find_pdf_file_by_folder(folder_pdf_files), embeddings, batch_size=batch_size, workers=workers,
+        chunker=chunker,
+    )
 
-    vectorstore = FAISS.from_documents(docs, embeddings)
-    vectorstore.save_local("./././faiss_index")
+    if vectorstore is not None:
+        save_index(vectorstore, index_path)
+    logger.info(f"Chunking: {chunker.stats.stats()}")
+    logger.info(f"Embedding cache: {cache_stats(embeddings)}")
@@ -0,0 +1,343 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_core.documents import Document
+from langchain.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+
+logger = logging.getLogger(__name__)
+
+FORMAT_NAME = "chat-faiss"
+FORMAT_VERSION = 1
+
+FAISS_FILE = "index.faiss"
+DOCSTORE_FILE = "docstore.sqlite3"
+META_FILE = "meta.json"
+LEGACY_DOCSTORE_FILE = "index.pkl"
+
+INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq", "sq", "ivfsq")
+
+DEFAULT_PARAMS = {
+    "nlist": 1024,       # IVF: number of clusters
+    "nprobe": 16,        # IVF: clusters visited per query
+    "hnsw_m": 32,        # HNSW: neighbours per node
+    "ef_construction": 200,
+    "ef_search": 64,
+    "pq_m": 64,          # PQ: sub-quantizers, must divide the embedding dimension
+    "pq_nbits": 8,
+    "sq_type": "SQ8",    # SQ8, SQ6, SQ4, SQfp16
+}
+
+# k-means wants roughly this many training points per centroid
+TRAINING_POINTS_PER_CENTROID = 39
+
+
+INDEX_FILES = (FAISS_FILE, META_FILE)
+LEGACY_INDEX_FILES = (FAISS_FILE, LEGACY_DOCSTORE_FILE)
+
+
+def index_signature(index_path: str) -> Optional[tuple]:
+    """Cheap fingerprint of the index files on disk, ``None`` if they are missing."""
+    for names in (INDEX_FILES, LEGACY_INDEX_FILES):
+        try:
+            stats = [os.stat(os.path.join(index_path, name)) for name in names]
+        except FileNotFoundError:
+            continue
+        return tuple((stat.st_mtime_ns, stat.st_size) for stat in stats)
+    return None
+
+
+class IndexFormatError(Exception):
+    pass
+
+
+class EmbeddingMismatchError(IndexFormatError):
+    pass
+
+
+def describe_index(index) -> str:
+    """The ``INDEX_TYPES`` name of a FAISS index."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(index, faiss.IndexIVFScalarQuantizer):
+        return "ivfsq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return "sq"
+    return "flat"
+
+
+def index_factory_string(index_type: str, params: dict, count: int) -> str:
+    """FAISS factory string for ``index_type``, with IVF cluster counts sized to ``count`` vectors."""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown FAISS index type {index_type!r}; expected one of {INDEX_TYPES}")
+    nlist = max(1, min(params["nlist"], count // TRAINING_POINTS_PER_CENTROID))
+    if index_type == "ivf":
+        return f"IVF{nlist},Flat"
+    if index_type == "hnsw":
+        return f"HNSW{params['hnsw_m']}"
+    if index_type == "ivfpq":
+        return f"IVF{nlist},PQ{params['pq_m']}x{params['pq_nbits']}"
+    if index_type == "sq":
+        return params["sq_type"]
+    if index_type == "ivfsq":
+        return f"IVF{nlist},{params['sq_type']}"
+    return "Flat"
+
+
+def apply_search_params(index, params: dict):
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVF):
+        index.nprobe = params["nprobe"]
+    elif isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = params["ef_search"]
+
+
+def _all_vectors(index) -> np.ndarray:
+    if isinstance(faiss.downcast_index(index), faiss.IndexIVF):
+        faiss.extract_index_ivf(index).make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def text_embeddings(vectorstore: FAISS) -> Tuple[List[Tuple[str, np.ndarray]], List[dict], List[str]]:
+    """The ``(text, vector)`` pairs, metadata and ids of every chunk in ``vectorstore``, in index order.
+
+    Lossy indexes (PQ, SQ) give back approximations of the vectors they were built from.
+    """
+    count = vectorstore.index.ntotal
+    vectors = _all_vectors(vectorstore.index) if count else []
+    ids = [vectorstore.index_to_docstore_id[position] for position in range(count)]
+    documents = [vectorstore.docstore.search(doc_id) for doc_id in ids]
+    return (
+        [(document.page_content, vector) for document, vector in zip(documents, vectors)],
+        [document.metadata for document in documents],
+        ids,
+    )
+
+
+def build_index(vectorstore: FAISS, index_type: str, params: Optional[dict] = None) -> bool:
+    """Re-encode the vectors of ``vectorstore`` into an index of ``index_type``.
+
+    Vector positions are preserved, so the docstore mapping stays valid. Returns
+    False and keeps the current index when there are too few vectors to train
+    the quantizer.
+    """
+    params = dict(DEFAULT_PARAMS, **(params or {}))
+    current = vectorstore.index
+    if current.ntotal == 0:
+        return False
+    if index_type == "ivfpq" and current.ntotal < 2 ** params["pq_nbits"]:
+        logger.warning(
+            f"Only {current.ntotal} vectors, too few to train a {index_type} index; keeping {describe_index(current)}"
+        )
+        return False
+    factory = index_factory_string(index_type, params, current.ntotal)
+    vectors = _all_vectors(current)
+    index = faiss.index_factory(current.d, factory, current.metric_type)
+    if isinstance(faiss.downcast_index(index), faiss.IndexHNSW):
+        faiss.downcast_index(index).hnsw.efConstruction = params["ef_construction"]
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    apply_search_params(index, params)
+    vectorstore.index = index
+    logger.info(f"Built {factory} index over {index.ntotal} vectors")
+    return True
+
+
+def delete_vectors(vectorstore: FAISS, ids: Iterable[str]):
+    """``vectorstore.delete`` that also works for indexes without ``remove_ids`` (HNSW).
+
+    Those are rebuilt from their own reconstructed vectors, reusing the trained
+    structure of the existing index.
+    """
+    ids = list(ids)
+    if not ids:
+        return
+    try:
+        vectorstore.delete(ids)
+        return
+    except RuntimeError:
+        pass
+    removed = set(ids)
+    keep = sorted(position for position, doc_id in vectorstore.index_to_docstore_id.items() if doc_id not in removed)
+    vectors = _all_vectors(vectorstore.index)[keep]
+    index = faiss.clone_index(vectorstore.index)
+    index.reset()
+    index.add(vectors)
+    vectorstore.index = index
+    vectorstore.docstore.delete(ids)
+    vectorstore.index_to_docstore_id = {
+        new: vectorstore.index_to_docstore_id[old] for new, old in enumerate(keep)
+    }
+
+
+class SQLiteDocstore(Docstore):
+    """Read-only docstore that fetches chunks from ``docstore.sqlite3`` on demand."""
+
+    def __init__(self, path: str):
+        self._connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+
+    def search(self, search: str):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT content, metadata FROM documents WHERE id = ?", (search,)
+            ).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(page_content=row[0], metadata=json.loads(row[1]))
+
+
+def write_index(vectorstore: FAISS, directory: str):
+    """Write ``vectorstore`` into ``directory`` as FAISS vectors, an SQLite docstore and ``meta.json``."""
+    directory = str(directory)
+    os.makedirs(directory, exist_ok=True)
+    faiss.write_index(vectorstore.index, os.path.join(directory, FAISS_FILE))
+
+    connection = sqlite3.connect(os.path.join(directory, DOCSTORE_FILE))
+    try:
+        connection.execute(
+            "CREATE TABLE documents (position INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, "
+            "content TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        rows = []
+        for position, doc_id in vectorstore.index_to_docstore_id.items():
+            document = vectorstore.docstore.search(doc_id)
+            rows.append((position, doc_id, document.page_content, json.dumps(document.metadata)))
+        connection.executemany("INSERT INTO documents VALUES (?, ?, ?, ?)", rows)
+        connection.commit()
+    finally:
+        connection.close()
+
+    meta = {
+        "format": FORMAT_NAME,
+        "version": FORMAT_VERSION,
+        "index_type": describe_index(vectorstore.index),
+        "dimension": vectorstore.index.d,
+        "count": vectorstore.index.ntotal,
+        "metric": "inner_product" if vectorstore.index.metric_type == faiss.METRIC_INNER_PRODUCT else "l2",
+        "distance_strategy": str(vectorstore.distance_strategy.value),
+        "normalize_l2": bool(vectorstore._normalize_L2),
+        "embedding": getattr(vectorstore.embedding_function, "identity", None),
+    }
+    with open(os.path.join(directory, META_FILE), "w") as meta_file:
+        json.dump(meta, meta_file, indent=2)
+
+
+def read_meta(directory: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(str(directory), META_FILE)) as meta_file:
+            return json.load(meta_file)
+    except FileNotFoundError:
+        return None
+
+
+def check_embedding(meta: dict, embeddings, directory: str = ""):
+    """Refuse an index whose vectors came from different embeddings than ``embeddings``."""
+    expected = getattr(embeddings, "identity", None)
+    recorded = meta.get("embedding")
+    if expected is None:
+        return
+    if recorded is None:
+        dimension = expected.get("dimension")
+        if dimension is not None and dimension != meta.get("dimension"):
+            raise EmbeddingMismatchError(
+                f"Index {directory} has {meta.get('dimension')}-dimensional vectors, {expected} produces {dimension}"
+            )
+        logger.warning(f"Index {directory} does not record its embeddings; assuming {expected}")
+        return
+    if recorded != expected:
+        raise EmbeddingMismatchError(
+            f"Index {directory} was built with {recorded} embeddings but {expected} is configured; "
+            f"re-embed it with `manage.py reindex --reembed`"
+        )
+
+
+def reembed(vectorstore: FAISS, embeddings, batch_size: int = 256) -> FAISS:
+    """A copy of ``vectorstore`` with every chunk embedded again by ``embeddings``; ids are kept."""
+    doc_ids = [doc_id for _, doc_id in sorted(vectorstore.index_to_docstore_id.items())]
+    rebuilt = None
+    for start in range(0, len(doc_ids), batch_size):
+        ids = doc_ids[start:start + batch_size]
+        documents = [vectorstore.docstore.search(doc_id) for doc_id in ids]
+        if rebuilt is None:
+            rebuilt = FAISS.from_documents(documents, embeddings, ids=ids)
+        else:
+            rebuilt.add_documents(documents, ids=ids)
+    return rebuilt
+
+
+def read_index(directory: str, embeddings, mmap: bool = False, allow_pickle: bool = False,
+               params: Optional[dict] = None, verify_embedding: bool = True) -> FAISS:
+    """Load an index written by ``write_index``.
+
+    With ``mmap`` the vectors are memory-mapped read-only and chunks are read
+    from SQLite as they are retrieved, so start-up cost and resident memory
+    do not grow with the corpus; writers load without it to get a mutable copy.
+    Pickled LangChain indexes from before the format existed are only read with
+    ``allow_pickle``. Indexes built with other embeddings than ``embeddings``
+    raise :class:`EmbeddingMismatchError` unless ``verify_embedding`` is off.
+    """
+    directory = str(directory)
+    meta = read_meta(directory)
+    if meta is None:
+        if os.path.exists(os.path.join(directory, LEGACY_DOCSTORE_FILE)):
+            if not allow_pickle:
+                raise IndexFormatError(
+                    f"{directory} is a pickled LangChain index; convert it with `manage.py reindex --allow-pickle`"
+                )
+            logger.warning(f"Loading pickled index from {directory}")
+            return FAISS.load_local(directory, embeddings, allow_dangerous_deserialization=True)
+        raise IndexFormatError(f"No index found in {directory}")
+    if meta.get("format") != FORMAT_NAME or meta.get("version") != FORMAT_VERSION:
+        raise IndexFormatError(f"Unsupported index format {meta.get('format')!r} v{meta.get('version')} in {directory}")
+    if verify_embedding:
+        check_embedding(meta, embeddings, directory)
+
+    if mmap:
+        flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+        index = faiss.read_index(os.path.join(directory, FAISS_FILE), flags)
+    else:
+        index = faiss.read_index(os.path.join(directory, FAISS_FILE))
+    apply_search_params(index, dict(DEFAULT_PARAMS, **(params or {})))
+
+    connection = sqlite3.connect(f"file:{os.path.join(directory, DOCSTORE_FILE)}?mode=ro", uri=True)
+    try:
+        if mmap:
+            index_to_docstore_id: Dict[int, str] = dict(
+                connection.execute("SELECT position, id FROM documents")
+            )
+            docstore = SQLiteDocstore(os.path.join(directory, DOCSTORE_FILE))
+        else:
+            index_to_docstore_id = {}
+            documents = {}
+            for position, doc_id, content, metadata in connection.execute(
+                "SELECT position, id, content, metadata FROM documents"
+            ):
+                index_to_docstore_id[position] = doc_id
+                documents[doc_id] = Document(page_content=content, metadata=json.loads(metadata))
+            docstore = InMemoryDocstore(documents)
+    finally:
+        connection.close()
+
+    return FAISS(
+        embeddings,
+        index,
+        docstore,
+        index_to_docstore_id,
+        normalize_L2=meta.get("normalize_l2", False),
+        distance_strategy=DistanceStrategy(meta.get("distance_strategy", DistanceStrategy.EUCLIDEAN_DISTANCE.value)),
+    )
@@ -0,0 +1,213 @@
+import json
+import logging
+import os
+import shutil
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from langchain.vectorstores import FAISS
+
+from .chunking import Chunker
+from .embeddings import get_embeddings
+from .index_store import (
+    build_index, delete_vectors, describe_index, index_signature, read_index, text_embeddings, write_index,
+)
+from .lexical import build_lexical_index
+from .shards import (
+    bump_shard_generation, collection_path, document_shard_ids, document_shard_path, get_shard_root,
+    remove_document_shard,
+)
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to the in-process lock only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+MANIFEST_FILE = "manifest.json"
+
+
+def save_index(vectorstore: FAISS, index_path: str, manifest: Optional[dict] = None, rebuild: bool = False,
+               index_type: Optional[str] = None):
+    """Write ``vectorstore`` next to ``index_path`` and swap it into place.
+
+    The vectors are first re-encoded into ``index_type`` (the configured
+    ``FAISS_INDEX_TYPE`` by default) if they are not stored that way yet, or always with ``rebuild`` (after
+    changing ``FAISS_INDEX_PARAMS``, or once IVF clusters have gone stale).
+
+    Readers either see the complete old index or the complete new one, never a
+    half-written pair of files. The ingestion manifest travels with the index:
+    it is replaced when ``manifest`` is given and carried over otherwise, and
+    the lexical index is rebuilt from the same chunks.
+    """
+    index_path = str(index_path)
+    tmp_path = f"{index_path}.tmp-{os.getpid()}"
+    old_path = f"{index_path}.old-{os.getpid()}"
+    index_type = index_type or getattr(settings, "FAISS_INDEX_TYPE", "flat")
+    if rebuild or describe_index(vectorstore.index) != index_type:
+        build_index(vectorstore, index_type, getattr(settings, "FAISS_INDEX_PARAMS", None))
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    write_index(vectorstore, tmp_path)
+    build_lexical_index(vectorstore, tmp_path)
+    if manifest is not None:
+        with open(os.path.join(tmp_path, MANIFEST_FILE), "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+    elif os.path.exists(os.path.join(index_path, MANIFEST_FILE)):
+        shutil.copy2(os.path.join(index_path, MANIFEST_FILE), tmp_path)
+    if os.path.exists(index_path):
+        os.rename(index_path, old_path)
+    os.rename(tmp_path, index_path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def load_manifest(index_path: str) -> dict:
+    try:
+        with open(os.path.join(str(index_path), MANIFEST_FILE)) as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return {}
+
+
+@contextmanager
+def index_file_lock(index_path: str, blocking: bool = True):
+    """Exclusive lock on ``index_path`` across processes; yields False if ``blocking`` is off and it is held."""
+    if fcntl is None:
+        yield True
+        return
+    with open(f"{index_path}.lock", "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def split_document(document) -> List[str]:
+    return [chunk for _, chunk in Chunker().chunk_document([(None, document.content)])]
+
+
+def chunk_metadata(document, page=None) -> dict:
+    metadata = {"document_id": document.id, "title": document.title}
+    if page is not None:
+        metadata["page"] = page
+    return metadata
+
+
+def document_chunks(document) -> Tuple[List[str], List[dict], Optional[List[np.ndarray]]]:
+    """Texts, metadata and checkpointed vectors to index for ``document``.
+
+    Stored chunks are used when the document has them, its split content
+    otherwise; vectors are None unless every stored chunk has been embedded.
+    """
+    chunks = list(document.chunks.order_by('position').values_list('content', 'page', 'embedding'))
+    if chunks:
+        vectors = None
+        if all(embedding is not None for _, _, embedding in chunks):
+            vectors = [np.frombuffer(embedding, dtype=np.float32) for _, _, embedding in chunks]
+        return (
+            [content for content, _, _ in chunks],
+            [chunk_metadata(document, page) for _, page, _ in chunks],
+            vectors,
+        )
+    texts = split_document(document)
+    return texts, [chunk_metadata(document) for _ in texts], None
+
+
+def index_document(document):
+    """Write ``document`` to its own index shard, replacing the shard it already has."""
+    texts, metadatas, vectors = document_chunks(document)
+    if not texts:
+        remove_document(document.id)
+        return
+    ids = [f"document-{document.id}-{i}" for i in range(len(texts))]
+    if vectors is None:
+        vectorstore = FAISS.from_texts(texts, get_embeddings(), metadatas=metadatas, ids=ids)
+    else:
+        vectorstore = FAISS.from_embeddings(list(zip(texts, vectors)), get_embeddings(), metadatas=metadatas, ids=ids)
+    shard_path = document_shard_path(document.id)
+    os.makedirs(get_shard_root(), exist_ok=True)
+    with index_file_lock(shard_path):
+        save_index(vectorstore, shard_path, index_type=getattr(settings, "FAISS_SHARD_INDEX_TYPE", "flat"))
+    update_collection(document.id, vectorstore)
+    bump_shard_generation()
+    logger.info(f"Indexed document {document.id} as {len(texts)} chunks in {shard_path}")
+
+
+def remove_document(document_id):
+    update_collection(document_id)
+    remove_document_shard(document_id)
+    logger.info(f"Removed the index shard of document {document_id}")
+
+
+def _add_chunks(collection: Optional[FAISS], vectorstore: FAISS, embeddings) -> Optional[FAISS]:
+    text_vectors, metadatas, ids = text_embeddings(vectorstore)
+    if not text_vectors:
+        return collection
+    if collection is None:
+        return FAISS.from_embeddings(text_vectors, embeddings, metadatas=metadatas, ids=ids)
+    collection.add_embeddings(text_vectors, metadatas=metadatas, ids=ids)
+    return collection
+
+
+def _merge_document_shards(embeddings, exclude=None) -> Optional[FAISS]:
+    collection = None
+    for document_id in document_shard_ids():
+        if document_id == exclude:
+            continue
+        shard_path = document_shard_path(document_id)
+        with index_file_lock(shard_path):
+            if index_signature(shard_path) is None:
+                continue
+            collection = _add_chunks(collection, read_index(shard_path, embeddings), embeddings)
+    return collection
+
+
+def _save_collection(collection: Optional[FAISS], path: str):
+    if collection is None or collection.index.ntotal == 0:
+        shutil.rmtree(path, ignore_errors=True)
+        return
+    save_index(collection, path, index_type=getattr(settings, "FAISS_SHARD_INDEX_TYPE", "flat"))
+
+
+def update_collection(document_id, vectorstore: Optional[FAISS] = None):
+    """Replace the chunks of ``document_id`` in the collection shard with those of ``vectorstore``, or drop them.
+
+    The collection holds every document's chunks, so that chats not scoped to
+    particular documents search one shard instead of all of them. A missing
+    collection is rebuilt from the other document shards first.
+    """
+    path = collection_path()
+    embeddings = get_embeddings()
+    os.makedirs(get_shard_root(), exist_ok=True)
+    with index_file_lock(path):
+        if index_signature(path) is None:
+            collection = _merge_document_shards(embeddings, exclude=int(document_id))
+        else:
+            collection = read_index(path, embeddings, params=getattr(settings, "FAISS_INDEX_PARAMS", None))
+            prefix = f"document-{document_id}-"
+            delete_vectors(collection, [
+                doc_id for doc_id in collection.index_to_docstore_id.values() if doc_id.startswith(prefix)
+            ])
+        if vectorstore is not None:
+            collection = _add_chunks(collection, vectorstore, embeddings)
+        _save_collection(collection, path)
+
+
+def ensure_collection() -> bool:
+    """Build the collection shard from the document shards if it is missing; returns whether it was built."""
+    path = collection_path()
+    os.makedirs(get_shard_root(), exist_ok=True)
+    with index_file_lock(path):
+        if index_signature(path) is not None or not document_shard_ids():
+            return False
+        _save_collection(_merge_document_shards(get_embeddings()), path)
+    bump_shard_generation()
+    return True
@@ -0,0 +1,276 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from itertools import groupby
+from typing import Optional
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .answer_cache import get_answer_cache
+from .chunking import Chunker, ChunkStats, find_page_furniture
+from .embeddings import get_embeddings
+from .find_pdf_files import iter_pdf_pages, pdf_page_count
+from .indexing import index_document, index_file_lock, remove_document
+from .models import Document, DocumentChunk, IngestionJob
+from .shards import document_shard_path, get_shard_root
+
+logger = logging.getLogger(__name__)
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+class JobSuperseded(Exception):
+    """The job was replaced by a newer one for the same document while it ran."""
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, "DOCUMENT_INGESTION_WORKERS", 2),
+                    thread_name_prefix="ingestion",
+                )
+    return _executor
+
+
+def start_ingestion(document: Document) -> IngestionJob:
+    """Queue ``document`` to be split, embedded and indexed in the background.
+
+    The job row is the queue entry: it is picked up by the in-process worker
+    pool once the surrounding transaction commits, and by
+    ``manage.py run_ingestion`` if the process dies before or while running it.
+    Unfinished jobs for the same document are superseded by the new one.
+    """
+    IngestionJob.objects.filter(
+        document=document, status__in=[IngestionJob.STATUS_PENDING, IngestionJob.STATUS_RUNNING]
+    ).update(status=IngestionJob.STATUS_FAILED, error="Superseded by a newer ingestion job")
+    Document.objects.filter(id=document.id).update(status=Document.STATUS_PENDING, error='')
+    document.status = Document.STATUS_PENDING
+    job = IngestionJob.objects.create(document=document)
+    schedule_job(job)
+    return job
+
+
+def ingestion_lock(document_id, blocking: bool = True):
+    """Held by the worker running a job of ``document_id`` for the whole run.
+
+    Jobs of one document never run at once, in this process or another: a new
+    job waits for a superseded one to stop at its next checkpoint. The lock
+    goes with the process, so a job whose lock is free has no live worker.
+    """
+    os.makedirs(get_shard_root(), exist_ok=True)
+    return index_file_lock(ingestion_lock_path(document_id), blocking=blocking)
+
+
+def ingestion_lock_path(document_id) -> str:
+    # Not the shard's own lock file, which index_document takes while this one is held
+    return f"{document_shard_path(document_id)}.ingest"
+
+
+def delete_document_index(document_id):
+    """Remove the index shard of a document whose row has been deleted.
+
+    A job still running for it stops at its next checkpoint, its row being
+    gone with the document; waiting for it means the shard cannot be written
+    again after it is removed.
+    """
+    with ingestion_lock(document_id):
+        remove_document(document_id)
+        # Removed while held: a worker still waiting on it finds its job gone once it gets it
+        try:
+            os.remove(f"{ingestion_lock_path(document_id)}.lock")
+        except FileNotFoundError:
+            pass
+
+
+def schedule_job(job: IngestionJob):
+    if getattr(settings, "DOCUMENT_INGESTION_IN_PROCESS", True):
+        transaction.on_commit(lambda: get_executor().submit(_run_in_worker, job.id))
+
+
+def _run_in_worker(job_id):
+    try:
+        run_ingestion(job_id)
+    finally:
+        close_old_connections()
+
+
+def split_into_chunks(job: IngestionJob) -> ChunkStats:
+    """Replace the ``DocumentChunk`` rows of the job's document with the output of the chunking stage.
+
+    Uploaded PDFs are read one page at a time, in two passes: the first finds
+    the page furniture to strip, the second chunks the pages. Each write is
+    checkpointed in the same transaction, so a superseded job stops before it
+    touches the chunks again.
+    """
+    document = job.document
+    with transaction.atomic():
+        _checkpoint(job)
+        DocumentChunk.objects.filter(document=document).delete()
+    chunker = Chunker()
+    if document.file:
+        document.page_count = pdf_page_count(document.file.path)
+        furniture = find_page_furniture(text for _, text in iter_pdf_pages(document.file.path))
+        pages = iter_pdf_pages(document.file.path)
+    else:
+        furniture = set()
+        pages = [(None, document.content)]
+    position = 0
+    for page_number, page_chunks in groupby(chunker.chunk_pages(pages, furniture), key=lambda chunk: chunk[0]):
+        chunks = [
+            DocumentChunk(document=document, position=position + i, page=page_number, content=chunk)
+            for i, (_, chunk) in enumerate(page_chunks)
+        ]
+        with transaction.atomic():
+            _checkpoint(job)
+            DocumentChunk.objects.bulk_create(chunks)
+        position += len(chunks)
+    return chunker.stats
+
+
+def embed_with_retries(embeddings, texts):
+    retries = getattr(settings, "DOCUMENT_INGESTION_RETRIES", 3)
+    delay = getattr(settings, "DOCUMENT_INGESTION_RETRY_DELAY", 1.0)
+    for attempt in range(retries + 1):
+        try:
+            return embeddings.embed_documents(texts)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            logger.warning(f"Embedding a batch of {len(texts)} chunks failed ({e}); retrying in {delay:.1f}s")
+            time.sleep(delay)
+            delay *= 2
+
+
+def _checkpoint(job: IngestionJob, **fields):
+    """Save job progress, unless the job has been superseded in the meantime."""
+    fields['updated_at'] = timezone.now()
+    if not IngestionJob.objects.filter(id=job.id, status=IngestionJob.STATUS_RUNNING).update(**fields):
+        raise JobSuperseded()
+    for name, value in fields.items():
+        setattr(job, name, value)
+
+
+def embed_chunks(job: IngestionJob, embeddings, batch_size: int):
+    """Embed the document's chunks batch by batch, storing each batch's vectors as a checkpoint."""
+    pending = DocumentChunk.objects.filter(document_id=job.document_id, embedding__isnull=True).order_by('position')
+    while True:
+        batch = list(pending.only('id', 'content')[:batch_size])
+        if not batch:
+            return
+        vectors = embed_with_retries(embeddings, [chunk.content for chunk in batch])
+        for chunk, vector in zip(batch, vectors):
+            chunk.embedding = np.asarray(vector, dtype=np.float32).tobytes()
+        with transaction.atomic():
+            _checkpoint(job, chunks_done=job.chunks_done + len(batch))
+            DocumentChunk.objects.bulk_update(batch, ['embedding'])
+
+
+def run_ingestion(job_id) -> bool:
+    """Run one queued ingestion job, resuming after its last embedded batch.
+
+    Returns False if the job was not pending or did not complete.
+    """
+    document_id = IngestionJob.objects.filter(
+        id=job_id, status=IngestionJob.STATUS_PENDING
+    ).values_list('document_id', flat=True).first()
+    if document_id is None:
+        return False
+    with ingestion_lock(document_id):
+        return _run_ingestion(job_id)
+
+
+def _run_ingestion(job_id) -> bool:
+    claimed = IngestionJob.objects.filter(
+        id=job_id, status=IngestionJob.STATUS_PENDING
+    ).update(status=IngestionJob.STATUS_RUNNING, attempts=F('attempts') + 1, updated_at=timezone.now())
+    if not claimed:
+        return False
+
+    job = IngestionJob.objects.select_related('document').get(id=job_id)
+    document = job.document
+    try:
+        if job.chunks_total is None:
+            Document.objects.filter(id=document.id).update(status=Document.STATUS_EXTRACTING)
+            chunk_stats = split_into_chunks(job).stats()
+            Document.objects.filter(id=document.id).update(page_count=document.page_count)
+            _checkpoint(job, chunks_total=chunk_stats["chunks"], chunks_done=0, chunk_stats=chunk_stats)
+            logger.info(f"Chunked document {document.id}: {chunk_stats}")
+        else:
+            # Resuming: chunks already embedded by an earlier attempt are kept
+            done = DocumentChunk.objects.filter(document=document, embedding__isnull=False).count()
+            _checkpoint(job, chunks_done=done)
+
+        Document.objects.filter(id=document.id).update(status=Document.STATUS_INDEXING)
+        embed_chunks(job, get_embeddings(), getattr(settings, "DOCUMENT_INGESTION_BATCH_SIZE", 64))
+        _checkpoint(job)
+        index_document(document)
+        get_answer_cache().invalidate()
+        DocumentChunk.objects.filter(document=document).update(embedding=None)
+
+        _checkpoint(job, status=IngestionJob.STATUS_DONE, error='', completed_at=timezone.now())
+        Document.objects.filter(id=document.id).update(
+            status=Document.STATUS_READY, error='', vectorstore_path=document_shard_path(document.id), updated_at=timezone.now()
+        )
+        logger.info(f"Ingested document {document.id}: {job.chunks_total} chunks in {job.attempts} attempt(s)")
+        return True
+    except JobSuperseded:
+        logger.info(f"Ingestion job {job.id} of document {document.id} was superseded")
+        if not Document.objects.filter(id=document.id).exists():
+            # Deleted while its shard was being written; the delete's own removal may have come first
+            remove_document(document.id)
+        return False
+    except Exception as e:
+        logger.error(f"Error ingesting document {document.id}: {str(e)}")
+        failed = IngestionJob.objects.filter(id=job.id, status=IngestionJob.STATUS_RUNNING).update(
+            status=IngestionJob.STATUS_FAILED, error=str(e), updated_at=timezone.now()
+        )
+        # A superseded job no longer owns the document's status
+        if failed:
+            Document.objects.filter(id=document.id).update(
+                status=Document.STATUS_FAILED, error=str(e), updated_at=timezone.now()
+            )
+        return False
+
+
+def retry_job(job: IngestionJob) -> bool:
+    """Re-queue a failed ``job``; it resumes from its last checkpoint.
+
+    Jobs superseded by a newer one for the same document are not retried.
+    """
+    if IngestionJob.objects.filter(document_id=job.document_id, id__gt=job.id).exists():
+        return False
+    requeued = IngestionJob.objects.filter(
+        id=job.id, status=IngestionJob.STATUS_FAILED
+    ).update(status=IngestionJob.STATUS_PENDING, error='', updated_at=timezone.now())
+    if requeued:
+        Document.objects.filter(id=job.document_id).update(status=Document.STATUS_PENDING, error='')
+        schedule_job(job)
+    return bool(requeued)
+
+
+def requeue_stale_jobs(stale_after: float) -> int:
+    """Return running jobs whose worker has died to the queue.
+
+    Jobs that have not checkpointed for ``stale_after`` seconds are only
+    requeued once their document's :func:`ingestion_lock` is free; a worker
+    still holding it is slow, not gone.
+    """
+    cutoff = timezone.now() - timedelta(seconds=stale_after)
+    stale = IngestionJob.objects.filter(status=IngestionJob.STATUS_RUNNING, updated_at__lt=cutoff)
+    requeued = 0
+    for job_id, document_id in stale.values_list('id', 'document_id'):
+        with ingestion_lock(document_id, blocking=False) as free:
+            if free:
+                requeued += stale.filter(id=job_id).update(status=IngestionJob.STATUS_PENDING)
+    return requeued
@@ -0,0 +1,101 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+from typing import List, Tuple
+
+logger = logging.getLogger(__name__)
+
+LEXICAL_FILE = "lexical.sqlite3"
+
+TOKEN_PATTERN = re.compile(r"\w+(?:[-./]\w+)*", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text)
+
+
+def fts_query(query: str) -> str:
+    """Turn free text into an FTS5 ``OR`` query of quoted terms.
+
+    Quoting keeps user input from being parsed as FTS syntax, and hyphenated or
+    dotted identifiers (``XR-200``, ``v2.1``) become phrase matches of their parts.
+    """
+    terms = dict.fromkeys(token.lower() for token in tokenize(query))
+    return " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def _create_table(connection: sqlite3.Connection):
+    connection.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5("
+        "doc_id UNINDEXED, content, tokenize = 'unicode61 remove_diacritics 2')"
+    )
+
+
+def _docstore_rows(vectorstore):
+    for doc_id in vectorstore.index_to_docstore_id.values():
+        document = vectorstore.docstore.search(doc_id)
+        if hasattr(document, "page_content"):
+            yield doc_id, document.page_content
+
+
+def build_lexical_index(vectorstore, directory: str):
+    """Write an FTS5 index over every chunk of ``vectorstore`` into ``directory``."""
+    path = os.path.join(str(directory), LEXICAL_FILE)
+    if os.path.exists(path):
+        os.remove(path)
+    connection = sqlite3.connect(path)
+    try:
+        _create_table(connection)
+        connection.executemany("INSERT INTO chunks (doc_id, content) VALUES (?, ?)", _docstore_rows(vectorstore))
+        connection.execute("INSERT INTO chunks (chunks) VALUES ('optimize')")
+        connection.commit()
+    finally:
+        connection.close()
+    return path
+
+
+class LexicalIndex:
+    """BM25 search over the chunks of one FAISS index, backed by SQLite FTS5."""
+
+    def __init__(self, connection: sqlite3.Connection):
+        self._connection = connection
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, directory: str) -> "LexicalIndex":
+        path = os.path.join(str(directory), LEXICAL_FILE)
+        return cls(sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False))
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore) -> "LexicalIndex":
+        """In-memory index, for FAISS indexes written before the lexical file existed."""
+        connection = sqlite3.connect(":memory:", check_same_thread=False)
+        _create_table(connection)
+        connection.executemany("INSERT INTO chunks (doc_id, content) VALUES (?, ?)", _docstore_rows(vectorstore))
+        connection.commit()
+        return cls(connection)
+
+    @classmethod
+    def load(cls, directory: str, vectorstore) -> "LexicalIndex":
+        if os.path.exists(os.path.join(str(directory), LEXICAL_FILE)):
+            return cls.open(directory)
+        logger.warning(f"No lexical index in {directory}; building one in memory")
+        return cls.from_vectorstore(vectorstore)
+
+    def search(self, query: str, k: int = 4) -> List[Tuple[str, float]]:
+        """Return up to ``k`` ``(doc_id, bm25)`` pairs, best first (lower bm25 is better)."""
+        match = fts_query(query)
+        if not match:
+            return []
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT doc_id, bm25(chunks) AS score FROM chunks WHERE chunks MATCH ? ORDER BY score LIMIT ?",
+                (match, k),
+            ).fetchall()
+        return [(doc_id, score) for doc_id, score in rows]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,417 @@
+import asyncio
+import contextvars
+import json
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from django.conf import settings
+from langchain_community.chat_models import ChatOpenAI
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatResult
+
+from .tracing import record
+
+logger = logging.getLogger(__name__)
+
+# Absolute time.monotonic() by which the current request must be answered
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("llm_deadline", default=None)
+
+
+class LLMUnavailable(Exception):
+    """No LLM capacity within the request's deadline; the request should be answered with 503."""
+
+    def __init__(self, message: str, retry_after: float = 5.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@contextmanager
+def request_deadline(seconds: Optional[float] = None):
+    """Give the LLM calls made inside the block ``seconds`` in total (``LLM_REQUEST_DEADLINE`` by default)."""
+    if seconds is None:
+        seconds = getattr(settings, "LLM_REQUEST_DEADLINE", 60.0)
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time(default: Optional[float] = None) -> Optional[float]:
+    """Seconds left of the request deadline, or ``default`` outside one."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return default
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise LLMUnavailable("The request deadline passed before the model could be called")
+    return left
+
+
+class _LeaderCancelled(Exception):
+    """The caller running a shared call was cancelled; a waiting caller takes over."""
+
+
+class SingleFlight:
+    """Runs a call once for all callers asking for the same key while it is in flight.
+
+    The first caller runs it; callers arriving before it finishes wait for and
+    share its result (or exception). Sync and async callers share flights.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._flights: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key: Hashable):
+        """The flight for ``key``, and whether the caller leads it."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                return flight, False
+            self.calls += 1
+            flight = self._flights[key] = Future()
+            return flight, True
+
+    def _land(self, key: Hashable, flight: Future, result=None, error: Optional[BaseException] = None):
+        with self._lock:
+            self._flights.pop(key, None)
+        if error is None:
+            flight.set_result(result)
+        else:
+            flight.set_exception(error)
+
+    def do(self, key: Hashable, function: Callable[[], Any]):
+        flight, leader = self._join(key)
+        if not leader:
+            try:
+                return flight.result(timeout=remaining_time())
+            except FutureTimeoutError:
+                raise LLMUnavailable("Timed out waiting for an identical request in flight")
+            except _LeaderCancelled:
+                return self.do(key, function)
+        try:
+            result = function()
+        except BaseException as e:
+            self._land(key, flight, error=e)
+            raise
+        self._land(key, flight, result)
+        return result
+
+    async def ado(self, key: Hashable, function: Callable[[], Any]):
+        flight, leader = self._join(key)
+        if not leader:
+            try:
+                return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(flight)), remaining_time())
+            except asyncio.TimeoutError:
+                raise LLMUnavailable("Timed out waiting for an identical request in flight")
+            except _LeaderCancelled:
+                return await self.ado(key, function)
+        try:
+            result = await function()
+        except asyncio.CancelledError:
+            # A prefetch the agent never used, or a client that went away; not a failure of the call
+            self._land(key, flight, error=_LeaderCancelled())
+            raise
+        except BaseException as e:
+            self._land(key, flight, error=e)
+            raise
+        self._land(key, flight, result)
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._flights)}
+
+
+class _Waiter:
+    """A call queued for a slot: a thread blocked on an event, or a coroutine awaiting a future of ``loop``."""
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.loop = loop
+        self.granted = False
+        self.event = threading.Event() if loop is None else loop.create_future()
+
+    def grant(self) -> bool:
+        """Wake the waiter with a slot; False if it can no longer be woken."""
+        if self.loop is None:
+            self.event.set()
+        else:
+            try:
+                self.loop.call_soon_threadsafe(self._wake)
+            except RuntimeError:  # its event loop has closed
+                return False
+        self.granted = True
+        return True
+
+    def _wake(self):
+        if not self.event.done():
+            self.event.set_result(None)
+
+
+class ConcurrencyLimiter:
+    """Caps concurrent LLM calls at ``max_concurrent`` across the process.
+
+    Further calls queue for a slot until their deadline, first come first
+    served; a released slot is handed straight to the next one, whether it is
+    a thread or a coroutine. Once ``max_waiting`` calls are queued, new ones are
+    refused at once rather than piling up.
+    """
+
+    def __init__(self, max_concurrent: int = 8, max_waiting: int = 64):
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.active = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._waiters: "deque[_Waiter]" = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def _enqueue(self, loop: Optional[asyncio.AbstractEventLoop] = None) -> Optional[_Waiter]:
+        """Take a free slot (None) or queue for one (the waiter)."""
+        with self._lock:
+            if self.active < self.max_concurrent and not self._waiters:
+                self.active += 1
+                return None
+            if len(self._waiters) >= self.max_waiting:
+                self.rejected += 1
+                logger.warning(f"Refusing an LLM call: {len(self._waiters)} calls already queued")
+                raise LLMUnavailable(f"{len(self._waiters)} LLM calls are already queued")
+            waiter = _Waiter(loop)
+            self._waiters.append(waiter)
+            return waiter
+
+    def _withdraw(self, waiter: _Waiter) -> bool:
+        """Take a waiter that stopped waiting off the queue; True if it was granted a slot meanwhile."""
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._waiters.remove(waiter)
+            return False
+
+    def _timed_out(self, waited: float):
+        with self._lock:
+            self.timed_out += 1
+        record("llm_queue", waited)
+        raise LLMUnavailable(f"No LLM capacity within {waited:.1f}s")
+
+    def acquire(self):
+        """Take a slot, waiting no longer than the request deadline (``LLM_QUEUE_TIMEOUT`` outside one)."""
+        timeout = remaining_time(getattr(settings, "LLM_QUEUE_TIMEOUT", 30.0))
+        started = time.perf_counter()
+        waiter = self._enqueue()
+        if waiter is not None:
+            waiter.event.wait(timeout)
+            if not self._withdraw(waiter):
+                self._timed_out(time.perf_counter() - started)
+        record("llm_queue", time.perf_counter() - started)
+
+    async def aacquire(self):
+        timeout = remaining_time(getattr(settings, "LLM_QUEUE_TIMEOUT", 30.0))
+        started = time.perf_counter()
+        waiter = self._enqueue(asyncio.get_running_loop())
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(waiter.event, timeout)
+            except asyncio.TimeoutError:
+                if not self._withdraw(waiter):
+                    self._timed_out(time.perf_counter() - started)
+            except asyncio.CancelledError:
+                if self._withdraw(waiter):
+                    self.release()
+                raise
+        record("llm_queue", time.perf_counter() - started)
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                if self._waiters.popleft().grant():
+                    return
+            self.active -= 1
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def aslot(self):
+        await self.aacquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def saturated(self) -> bool:
+        """Whether a new call would be refused for lack of queue space."""
+        return self.waiting >= self.max_waiting
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "active": self.active,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+
+_limiter: Optional[ConcurrencyLimiter] = None
+_limiter_lock = threading.Lock()
+_single_flight = SingleFlight()
+_call_executor: Optional[ThreadPoolExecutor] = None
+_call_executor_lock = threading.Lock()
+
+
+def get_limiter() -> ConcurrencyLimiter:
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = ConcurrencyLimiter(
+                    max_concurrent=getattr(settings, "LLM_MAX_CONCURRENT_CALLS", 8),
+                    max_waiting=getattr(settings, "LLM_MAX_WAITING_CALLS", 64),
+                )
+    return _limiter
+
+
+def get_single_flight() -> SingleFlight:
+    return _single_flight
+
+
+def get_call_executor() -> ThreadPoolExecutor:
+    global _call_executor
+    if _call_executor is None:
+        with _call_executor_lock:
+            if _call_executor is None:
+                _call_executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, "LLM_MAX_CONCURRENT_CALLS", 8),
+                    thread_name_prefix="llm-call",
+                )
+    return _call_executor
+
+
+def call_within_deadline(function: Callable[[], Any]):
+    """Run a synchronous model call, giving up with :class:`LLMUnavailable` when the request deadline passes.
+
+    Past the deadline the call keeps its worker thread until it returns, but
+    nobody waits on it.
+    """
+    timeout = remaining_time()
+    if timeout is None:
+        return function()
+    future = get_call_executor().submit(contextvars.copy_context().run, function)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        raise LLMUnavailable("The model did not answer within the request deadline")
+
+
+async def acall_within_deadline(coroutine):
+    timeout = remaining_time()
+    try:
+        return await asyncio.wait_for(coroutine, timeout)
+    except asyncio.TimeoutError:
+        raise LLMUnavailable("The model did not answer within the request deadline")
+
+
+def prompt_key(model: BaseChatModel, messages: List[BaseMessage], stop: Optional[List[str]], kwargs: dict) -> str:
+    return json.dumps(
+        [model._llm_type, model._identifying_params, [(m.type, m.content) for m in messages], stop, kwargs],
+        sort_keys=True, default=str,
+    )
+
+
+class SharedChatModel(BaseChatModel):
+    """Routes a chat model's calls through the process-wide LLM call layer.
+
+    Every call takes a slot from :func:`get_limiter`; waiting for it and the
+    call itself end with :class:`LLMUnavailable` once the request deadline
+    (:func:`request_deadline`) has passed. Identical prompts in
+    flight at the same time are sent once; streaming models are not
+    coalesced, since only the caller that sent the prompt would see the tokens.
+    """
+
+    model: BaseChatModel
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def _llm_type(self) -> str:
+        return f"shared-{self.model._llm_type}"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return self.model._identifying_params
+
+    def _coalesce(self) -> bool:
+        return getattr(settings, "LLM_COALESCE", True) and not getattr(self.model, "streaming", False)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                  **kwargs: Any) -> ChatResult:
+        def call():
+            limiter = get_limiter()
+            limiter.acquire()
+            # Whoever takes this first releases the slot: the call once it returns (so a call
+            # abandoned at the deadline holds its slot until then), or the caller if it never started
+            unstarted = threading.Lock()
+
+            def generate():
+                if not unstarted.acquire(blocking=False):
+                    return None  # the caller has given up already
+                try:
+                    return self.model._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+                finally:
+                    limiter.release()
+
+            try:
+                return call_within_deadline(generate)
+            finally:
+                if unstarted.acquire(blocking=False):
+                    limiter.release()
+
+        if not self._coalesce():
+            return call()
+        return get_single_flight().do(prompt_key(self.model, messages, stop, kwargs), call)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                         **kwargs: Any) -> ChatResult:
+        async def call():
+            async with get_limiter().aslot():
+                return await acall_within_deadline(
+                    self.model._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+                )
+
+        if not self._coalesce():
+            return await call()
+        return await get_single_flight().ado(prompt_key(self.model, messages, stop, kwargs), call)
+
+
+def shared(model: BaseChatModel) -> SharedChatModel:
+    return model if isinstance(model, SharedChatModel) else SharedChatModel(model=model)
+
+
+def chat_model(model: str, **kwargs) -> SharedChatModel:
+    """An OpenAI chat model whose calls go through the shared LLM call layer."""
+    kwargs.setdefault("request_timeout", getattr(settings, "LLM_CALL_TIMEOUT", 60.0))
+    return shared(ChatOpenAI(model=model, **kwargs))
+
+
+def stats() -> Dict[str, Dict[str, int]]:
+    return {"limiter": get_limiter().stats(), "single_flight": get_single_flight().stats()}
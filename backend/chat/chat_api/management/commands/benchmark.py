@@ -0,0 +1,67 @@
+import json
+import sys
+from contextlib import redirect_stdout
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat_api.benchmarks import compare_results, run_benchmarks
+
+SECTIONS = ("startup", "ingestion", "query", "send_message")
+
+
+class Command(BaseCommand):
+    help = "Run the offline ingestion and query benchmarks and write the results as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", default=None, help="Write results to this JSON file (default: stdout).")
+        parser.add_argument("--compare", default=None, help="Baseline JSON file to report relative changes against.")
+        parser.add_argument("--sizes", default="1000,10000", help="Comma-separated corpus sizes in chunks.")
+        parser.add_argument("--queries", type=int, default=200, help="Retrieval queries per corpus size.")
+        parser.add_argument("--pdf-files", type=int, default=20, help="Synthetic PDFs for the ingestion benchmark.")
+        parser.add_argument("--pdf-pages", type=int, default=10, help="Pages per synthetic PDF.")
+        parser.add_argument("--dimension", type=int, default=1536, help="Fake embedding dimension.")
+        parser.add_argument("--requests", type=int, default=30, help="send_message requests per run.")
+        parser.add_argument("--workers", type=int, default=None, help="PDF extraction processes.")
+        parser.add_argument("--llm-latency", type=float, default=0.0, help="Seconds the stub LLM sleeps per call.")
+        parser.add_argument("--search-latency", type=float, default=0.0, help="Seconds the stub search sleeps.")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--skip", action="append", choices=SECTIONS, default=[], help="Skip a section.")
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options["sizes"].split(",") if size]
+        except ValueError:
+            raise CommandError(f"Invalid --sizes: {options['sizes']!r}")
+        if not sizes:
+            raise CommandError("At least one corpus size is required.")
+
+        # The agent prints its reasoning (verbose=True); keep stdout for the JSON
+        with redirect_stdout(sys.stderr):
+            results = run_benchmarks(
+                sizes,
+                queries=options["queries"],
+                pdf_files=options["pdf_files"],
+                pdf_pages=options["pdf_pages"],
+                dimension=options["dimension"],
+                requests=options["requests"],
+                workers=options["workers"],
+                llm_latency=options["llm_latency"],
+                search_latency=options["search_latency"],
+                seed=options["seed"],
+                skip=tuple(options["skip"]),
+            )
+
+        if options["compare"]:
+            with open(options["compare"]) as baseline_file:
+                results["comparison"] = compare_results(json.load(baseline_file), results)
+            for row in results["comparison"]:
+                self.stderr.write(f"{row['metric']}: {row['baseline']:.4g} -> {row['current']:.4g} "
+                                  f"({row['change']:+.1%})")
+
+        output = json.dumps(results, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as output_file:
+                output_file.write(output)
+            self.stdout.write(self.style.SUCCESS(f"Benchmark results written to {options['output']}"))
+        else:
+            self.stdout.write(output)
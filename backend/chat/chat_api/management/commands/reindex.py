@@ -0,0 +1,138 @@
+import hashlib
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat_api.chunking import Chunker
+from chat_api.embeddings import cache_stats, get_embeddings
+from chat_api.engine import get_index_path
+from chat_api.find_pdf_files import add_pdfs_to_vectorstore, find_pdf_file_by_folder
+from chat_api.index_store import IndexFormatError, delete_vectors, index_signature, read_index, read_meta, reembed
+from chat_api.indexing import ensure_collection, index_file_lock, load_manifest, save_index
+from chat_api.ingestion import start_ingestion
+from chat_api.models import Document
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as pdf_file:
+        for block in iter(lambda: pdf_file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Command(BaseCommand):
+    help = "Incrementally re-index the PDF folder, embedding only new or changed files."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--folder", default=os.getenv("FOLDER_PDF_FILES"),
+                            help="Folder with the PDF files (defaults to $FOLDER_PDF_FILES).")
+        parser.add_argument("--index-path", default=None, help="FAISS index directory (defaults to FAISS_INDEX_PATH).")
+        parser.add_argument("--batch-size", type=int, default=256, help="Chunks embedded per batch.")
+        parser.add_argument("--workers", type=int, default=None, help="PDF extraction processes.")
+        parser.add_argument("--full", action="store_true", help="Ignore the manifest and rebuild from scratch.")
+        parser.add_argument("--rebuild-index", action="store_true",
+                            help="Re-train the FAISS index (FAISS_INDEX_TYPE/FAISS_INDEX_PARAMS) even if unchanged.")
+        parser.add_argument("--allow-pickle", action="store_true",
+                            help="Read a pickled LangChain index once, converting it to the current format.")
+        parser.add_argument("--reembed", action="store_true",
+                            help="Embed every chunk again with the configured EMBEDDING_PROVIDER.")
+
+    def handle(self, *args, **options):
+        folder = options["folder"]
+        if not folder or not os.path.isdir(folder):
+            raise CommandError(f"PDF folder not found: {folder!r}")
+        index_path = options["index_path"] or get_index_path()
+        started = time.monotonic()
+        embeddings = get_embeddings()
+        # Document shards written before the collection shard existed
+        if ensure_collection():
+            self.stdout.write("Merged the document shards into the collection shard.")
+
+        with index_file_lock(index_path):
+            vectorstore = None
+            old_manifest = {}
+            pdf_ids = []
+            legacy_ids, legacy_documents = [], set()
+            if index_signature(index_path) is not None:
+                try:
+                    vectorstore = read_index(
+                        index_path, embeddings, allow_pickle=options["allow_pickle"],
+                        params=getattr(settings, "FAISS_INDEX_PARAMS", None),
+                        verify_embedding=not options["reembed"],
+                    )
+                except IndexFormatError as e:
+                    raise CommandError(str(e))
+                if options["reembed"]:
+                    vectorstore = reembed(vectorstore, embeddings, batch_size=options["batch_size"])
+                # Uploaded documents used to share this index; they now have shards of their own
+                for doc_id in vectorstore.index_to_docstore_id.values():
+                    document_id = vectorstore.docstore.search(doc_id).metadata.get("document_id")
+                    if document_id is not None:
+                        legacy_ids.append(doc_id)
+                        legacy_documents.add(document_id)
+                old_manifest = load_manifest(index_path).get("files")
+                if options["full"] or old_manifest is None:
+                    # No usable manifest: drop every PDF chunk
+                    pdf_ids = [
+                        doc_id for doc_id in vectorstore.index_to_docstore_id.values()
+                        if vectorstore.docstore.search(doc_id).metadata.get("document_id") is None
+                    ]
+                    old_manifest = {}
+
+            manifest = {}
+            to_embed = []
+            for path_ in sorted(find_pdf_file_by_folder(folder)):
+                stat = os.stat(path_)
+                entry = old_manifest.get(path_)
+                if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+                    manifest[path_] = entry
+                    continue
+                sha256 = file_sha256(path_)
+                if entry and entry["sha256"] == sha256:
+                    manifest[path_] = dict(entry, mtime=stat.st_mtime)
+                    continue
+                manifest[path_] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": sha256, "chunk_ids": []}
+                to_embed.append(path_)
+
+            changed = set(to_embed)
+            stale_ids = pdf_ids + legacy_ids + [
+                chunk_id
+                for path_, entry in old_manifest.items()
+                if path_ not in manifest or path_ in changed
+                for chunk_id in entry["chunk_ids"]
+            ]
+            removed_files = len([path_ for path_ in old_manifest if path_ not in manifest])
+            # Pickled or re-embedded indexes are rewritten even when no file changed
+            convert = vectorstore is not None and (read_meta(index_path) is None or options["reembed"])
+            if not to_embed and not stale_ids and manifest == old_manifest and not convert \
+                    and not options["rebuild_index"]:
+                self.stdout.write(f"Index is up to date ({len(manifest)} files).")
+                return
+
+            if stale_ids:
+                delete_vectors(vectorstore, stale_ids)
+
+            chunker = Chunker()
+            vectorstore, ids_by_source = add_pdfs_to_vectorstore(
+                vectorstore, to_embed, embeddings, batch_size=options["batch_size"], workers=options["workers"],
+                chunker=chunker,
+            )
+            for path_, ids in ids_by_source.items():
+                manifest[path_]["chunk_ids"] = ids
+
+            if vectorstore is None:
+                raise CommandError("No text could be extracted; refusing to write an empty index.")
+            save_index(vectorstore, index_path, manifest={"files": manifest}, rebuild=options["rebuild_index"])
+
+        for document in Document.objects.filter(id__in=legacy_documents):
+            start_ingestion(document)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Re-indexed {len(to_embed)} new or changed files, removed {removed_files} deleted files, "
+            f"dropped {len(stale_ids)} stale chunks in {time.monotonic() - started:.1f}s. "
+            f"Moved {len(legacy_documents)} uploaded documents to their own shards. "
+            f"Chunking: {chunker.stats.stats()}. Embedding cache: {cache_stats(embeddings)}"
+        ))
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from chat_api.evaluation import run_evaluation
+from chat_api.models import MessageEvaluation
+
+
+class Command(BaseCommand):
+    help = "Run queued answer evaluations, e.g. those left pending by a restarted worker."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=None, help="Evaluate at most this many messages.")
+        parser.add_argument("--loop", action="store_true", help="Keep polling for new evaluations.")
+        parser.add_argument("--interval", type=float, default=5.0, help="Seconds between polls with --loop.")
+
+    def handle(self, *args, **options):
+        evaluated = 0
+        while True:
+            pending = MessageEvaluation.objects.filter(
+                status=MessageEvaluation.STATUS_PENDING
+            ).order_by('created_at').values_list('id', flat=True)
+            if options["limit"] is not None:
+                pending = pending[:max(options["limit"] - evaluated, 0)]
+            pending = list(pending)
+
+            for evaluation_id in pending:
+                if run_evaluation(evaluation_id):
+                    evaluated += 1
+
+            if not options["loop"] or (options["limit"] is not None and evaluated >= options["limit"]):
+                break
+            if not pending:
+                time.sleep(options["interval"])
+
+        self.stdout.write(self.style.SUCCESS(f"Evaluated {evaluated} messages."))
@@ -0,0 +1,46 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat_api.ingestion import requeue_stale_jobs, run_ingestion
+from chat_api.models import IngestionJob
+
+
+class Command(BaseCommand):
+    help = "Run queued document ingestion jobs, resuming those interrupted by a restart."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=None, help="Run at most this many jobs.")
+        parser.add_argument("--loop", action="store_true", help="Keep polling for new jobs.")
+        parser.add_argument("--interval", type=float, default=5.0, help="Seconds between polls with --loop.")
+        parser.add_argument(
+            "--stale-after",
+            type=float,
+            default=getattr(settings, "DOCUMENT_INGESTION_STALE_AFTER", 300.0),
+            help="Resume running jobs that have not checkpointed for this many seconds.",
+        )
+
+    def handle(self, *args, **options):
+        completed = 0
+        while True:
+            requeued = requeue_stale_jobs(options["stale_after"])
+            if requeued:
+                self.stdout.write(f"Resuming {requeued} interrupted jobs.")
+            pending = IngestionJob.objects.filter(
+                status=IngestionJob.STATUS_PENDING
+            ).order_by('created_at').values_list('id', flat=True)
+            if options["limit"] is not None:
+                pending = pending[:max(options["limit"] - completed, 0)]
+            pending = list(pending)
+
+            for job_id in pending:
+                if run_ingestion(job_id):
+                    completed += 1
+
+            if not options["loop"] or (options["limit"] is not None and completed >= options["limit"]):
+                break
+            if not pending:
+                time.sleep(options["interval"])
+
+        self.stdout.write(self.style.SUCCESS(f"Completed {completed} ingestion jobs."))
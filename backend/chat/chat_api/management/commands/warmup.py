@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from chat_api.warmup import WARMUP_STEPS, warmup
+
+
+class Command(BaseCommand):
+    help = "Load the RAG pipeline, index, document shards and API clients, and report how long each took."
+
+    def handle(self, *args, **options):
+        timings = warmup()
+        for name, _ in WARMUP_STEPS:
+            self.stdout.write(f"{name:<10} {timings[name]:.2f}s")
+        boot = f" (process up {timings['boot']:.2f}s)" if "boot" in timings else ""
+        self.stdout.write(self.style.SUCCESS(f"Warmed up in {timings['total']:.2f}s{boot}."))
@@ -0,0 +1,102 @@
+import logging
+import threading
+from typing import List, Optional
+
+from django.conf import settings
+from langchain.memory import ConversationBufferMemory
+from langchain.schema import SystemMessage
+
+from .llm import chat_model
+from .models import Chat, Message
+from .tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = """Progressively summarize the conversation below, adding onto the previous summary.
+Keep facts, names, numbers and open questions the assistant may need later. Return only the new summary.
+
+PREVIOUS SUMMARY:
+{summary}
+
+NEW LINES OF CONVERSATION:
+{lines}
+
+NEW SUMMARY:"""
+
+_summary_llm = None
+_summary_llm_lock = threading.Lock()
+
+
+def get_summary_llm():
+    global _summary_llm
+    if _summary_llm is None:
+        with _summary_llm_lock:
+            if _summary_llm is None:
+                _summary_llm = chat_model(getattr(settings, "MEMORY_SUMMARY_MODEL", "gpt-3.5-turbo"))
+    return _summary_llm
+
+
+def summarize(summary: str, messages: List[Message], llm=None) -> str:
+    lines = "\n".join(f"{'Human' if msg.is_user else 'AI'}: {msg.content}" for msg in messages)
+    return (llm or get_summary_llm()).predict(SUMMARY_PROMPT.format(summary=summary or "(none)", lines=lines)).strip()
+
+
+def build_chat_memory(chat: Chat, exclude_message_id=None, max_tokens: Optional[int] = None,
+                      llm=None) -> ConversationBufferMemory:
+    """Conversation memory for ``chat``: its rolling summary plus the newest turns.
+
+    Messages are kept verbatim, newest first, up to ``max_tokens``. Older
+    messages that have not been summarized yet are folded into ``chat.summary``,
+    which is saved so later turns only ever summarize the few messages that just
+    left the window. A chat with more than ``MEMORY_MAX_UNSUMMARIZED_MESSAGES``
+    unsummarized messages has its oldest ones summarized that many per turn
+    until it has caught up; ``chat.summarized_until`` never passes a message
+    that was not summarized.
+    """
+    max_tokens = max_tokens or getattr(settings, "MEMORY_MAX_TOKENS", 2000)
+    fetch_limit = getattr(settings, "MEMORY_MAX_UNSUMMARIZED_MESSAGES", 200)
+
+    messages = Message.objects.filter(chat=chat)
+    if chat.summarized_until is not None:
+        messages = messages.filter(created_at__gt=chat.summarized_until)
+    if exclude_message_id is not None:
+        messages = messages.exclude(id=exclude_message_id)
+    # Newest first, bounded, so a long-neglected chat never loads its whole history
+    newest = list(messages.order_by('-created_at')[:fetch_limit + 1])
+    backlog = len(newest) > fetch_limit
+    newest = newest[:fetch_limit]
+
+    window = []
+    used_tokens = count_tokens(chat.summary) if chat.summary else 0
+    for msg in newest:
+        tokens = count_tokens(msg.content)
+        if window and used_tokens + tokens > max_tokens:
+            break
+        window.append(msg)
+        used_tokens += tokens
+    window.reverse()
+    if backlog:
+        # Messages older than the fetched ones are unsummarized too; summarize from the oldest
+        in_window = {msg.id for msg in window}
+        overflow = [msg for msg in messages.order_by('created_at')[:fetch_limit] if msg.id not in in_window]
+    else:
+        overflow = list(reversed(newest[len(window):]))
+
+    if overflow:
+        try:
+            chat.summary = summarize(chat.summary, overflow, llm=llm)
+            chat.summarized_until = overflow[-1].created_at
+            chat.save(update_fields=['summary', 'summarized_until'])
+        except Exception as e:
+            # Without a fresh summary the overflow is simply left out of this turn
+            logger.error(f"Error summarizing chat {chat.id}: {str(e)}")
+
+    memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
+    if chat.summary:
+        memory.chat_memory.add_message(SystemMessage(content=f"Summary of the earlier conversation: {chat.summary}"))
+    for msg in window:
+        if msg.is_user:
+            memory.chat_memory.add_user_message(msg.content)
+        else:
+            memory.chat_memory.add_ai_message(msg.content)
+    return memory
@@ -0,0 +1,126 @@
+# Generated by Django 4.2.20 on 2026-10-18 03:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Chat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=255)),
+                ('summary', models.TextField(blank=True, default='')),
+                ('summarized_until', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'chat_chat',
+            },
+        ),
+        migrations.CreateModel(
+            name='Document',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=255)),
+                ('content', models.TextField(blank=True, default='')),
+                ('file', models.FileField(blank=True, null=True, upload_to='documents/%Y/%m/')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('extracting', 'Extracting'), ('indexing', 'Indexing'), ('ready', 'Ready'), ('failed', 'Failed')], default='ready', max_length=16)),
+                ('error', models.TextField(blank=True, default='')),
+                ('page_count', models.PositiveIntegerField(default=0)),
+                ('vectorstore_path', models.CharField(blank=True, max_length=255, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'chat_document',
+            },
+        ),
+        migrations.CreateModel(
+            name='Message',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content', models.TextField()),
+                ('is_user', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('chat', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='chat_api.chat')),
+            ],
+            options={
+                'db_table': 'chat_message',
+                'ordering': ['created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='MessageEvaluation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('query', models.TextField()),
+                ('sources', models.TextField(blank=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='pending', max_length=16)),
+                ('confidence_score', models.FloatField(blank=True, null=True)),
+                ('explanation', models.TextField(blank=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('message', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='evaluation', to='chat_api.message')),
+            ],
+            options={
+                'db_table': 'chat_message_evaluation',
+            },
+        ),
+        migrations.CreateModel(
+            name='IngestionJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='pending', max_length=16)),
+                ('chunks_total', models.PositiveIntegerField(blank=True, null=True)),
+                ('chunks_done', models.PositiveIntegerField(default=0)),
+                ('chunk_stats', models.JSONField(blank=True, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ingestion_jobs', to='chat_api.document')),
+            ],
+            options={
+                'db_table': 'chat_ingestion_job',
+            },
+        ),
+        migrations.CreateModel(
+            name='DocumentChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+                ('page', models.PositiveIntegerField(blank=True, null=True)),
+                ('content', models.TextField()),
+                ('embedding', models.BinaryField(blank=True, null=True)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='chat_api.document')),
+            ],
+            options={
+                'db_table': 'chat_document_chunk',
+                'ordering': ['position'],
+            },
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='documents',
+            field=models.ManyToManyField(blank=True, db_table='chat_chat_documents', related_name='chats', to='chat_api.document'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['chat', 'created_at'], name='chat_message_chat_created'),
+        ),
+        migrations.AddConstraint(
+            model_name='documentchunk',
+            constraint=models.UniqueConstraint(fields=('document', 'position'), name='chat_document_chunk_position'),
+        ),
+    ]
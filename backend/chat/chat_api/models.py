@@ -2,8 +2,26 @@ from django.db import models
 
 
 class Document(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_EXTRACTING = 'extracting'
+    STATUS_INDEXING = 'indexing'
+    STATUS_READY = 'ready'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_EXTRACTING, 'Extracting'),
+        (STATUS_INDEXING, 'Indexing'),
+        (STATUS_READY, 'Ready'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
     title = models.CharField(max_length=255)
-    content = models.TextField()
+    # Text documents keep their content here; uploaded PDFs keep it in DocumentChunk rows
+    content = models.TextField(blank=True, default='')
+    file = models.FileField(upload_to='documents/%Y/%m/', blank=True, null=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_READY)
+    error = models.TextField(blank=True, default='')
+    page_count = models.PositiveIntegerField(default=0)
     vectorstore_path = models.CharField(max_length=255, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -15,14 +33,75 @@ class Document(models.Model):
         app_label = 'chat_api'
         db_table = 'chat_document'
 
+class DocumentChunk(models.Model):
+    document = models.ForeignKey(Document, related_name='chunks', on_delete=models.CASCADE)
+    position = models.PositiveIntegerField()
+    page = models.PositiveIntegerField(blank=True, null=True)
+    content = models.TextField()
+    # Ingestion checkpoint: float32 vector of the chunk, cleared once it is in the index
+    embedding = models.BinaryField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.document_id} #{self.position}"
+
+    class Meta:
+        ordering = ['position']
+        app_label = 'chat_api'
+        db_table = 'chat_document_chunk'
+        constraints = [
+            models.UniqueConstraint(fields=['document', 'position'], name='chat_document_chunk_position'),
+        ]
+
+class IngestionJob(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    document = models.ForeignKey(Document, related_name='ingestion_jobs', on_delete=models.CASCADE)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True)
+    # Unknown until the document has been split
+    chunks_total = models.PositiveIntegerField(blank=True, null=True)
+    chunks_done = models.PositiveIntegerField(default=0)
+    # Chunks, tokens and what page-furniture stripping and de-duplication saved
+    chunk_stats = models.JSONField(blank=True, null=True)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Touched after every embedded batch, so a stale running job is one whose worker died
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"Ingestion of document {self.document_id} ({self.status})"
+
+    class Meta:
+        app_label = 'chat_api'
+        db_table = 'chat_ingestion_job'
+
 class Chat(models.Model):
     title = models.CharField(max_length=255)
+    # Rolling summary of the messages that fell out of the conversation memory window
+    summary = models.TextField(blank=True, default='')
+    summarized_until = models.DateTimeField(blank=True, null=True)
+    # Documents this chat searches; none selected means the library and every document
+    documents = models.ManyToManyField(Document, blank=True, related_name='chats', db_table='chat_chat_documents')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.title
 
+    def document_ids(self):
+        """Ids of the documents to search, or None to search everything."""
+        return [document.id for document in self.documents.all()] or None
+
     class Meta:
         app_label = 'chat_api'
         db_table = 'chat_chat'
@@ -39,4 +118,38 @@ class Message(models.Model):
     class Meta:
         ordering = ['created_at']
         app_label = 'chat_api'
-        db_table = 'chat_message'
\ No newline at end of file
+        db_table = 'chat_message'
+        indexes = [
+            # Serves per-chat history pagination and the last-message lookup
+            models.Index(fields=['chat', 'created_at'], name='chat_message_chat_created'),
+        ]
+
+
+class MessageEvaluation(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    message = models.OneToOneField(Message, related_name='evaluation', on_delete=models.CASCADE)
+    query = models.TextField()
+    sources = models.TextField(blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True)
+    confidence_score = models.FloatField(blank=True, null=True)
+    explanation = models.TextField(blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"Evaluation of message {self.message_id} ({self.status})"
+
+    class Meta:
+        app_label = 'chat_api'
+        db_table = 'chat_message_evaluation'
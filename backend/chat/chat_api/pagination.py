@@ -0,0 +1,23 @@
+from rest_framework.pagination import CursorPagination
+
+
+class ChatCursorPagination(CursorPagination):
+    ordering = '-created_at'
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class MessageCursorPagination(CursorPagination):
+    # Newest first, so a client loads recent history and pages back in time
+    ordering = '-created_at'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+class DocumentChunkCursorPagination(CursorPagination):
+    ordering = 'position'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
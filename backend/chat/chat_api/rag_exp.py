@@ -1,134 +1,405 @@
-import fitz
-from langchain.embeddings import OpenAIEmbeddings
-from langchain.vectorstores import FAISS
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.tools import Tool
-from langchain.chains import RetrievalQA
-from langchain.chat_models import ChatOpenAI
-from langchain.agents import initialize_agent, Tool, AgentType
-from langchain_community.tools.tavily_search import TavilySearchResults
-from langchain_community.chat_models import ChatOpenAI
-from langchain.memory import ConversationBufferMemory
+import asyncio
+import contextvars
+import json
+import logging
 import os
-from .find_pdf_files import generate_list_texts_pdfs_files, convert_text_to_vec_db
-from dotenv import load_dotenv
-load_dotenv()
+import queue
+import re
+import threading
+import time
+from typing import Any, Dict, Iterator, Tuple
 
-os.environ["TAVILY_API_KEY"] = os.getenv("TAVILY_API_KEY")
-os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
-folder_pdf_files = os.getenv("FOLDER_PDF_FILES")
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from langchain.agents import AgentType, Tool, initialize_agent
+from langchain.memory import ConversationBufferMemory
+from langchain.prompts import MessagesPlaceholder
+from langchain_core.callbacks import BaseCallbackHandler
 
+from .answer_cache import normalize_query
+from .engine import get_engine
+from .llm import request_deadline
+from .tracing import LLM_CALLS, LLM_TOKENS, TOOL_CALLS, record, stage, stage_name
 
-def rag_with_internet_search(query_user):
-    embeddings = OpenAIEmbeddings()
+logger = logging.getLogger(__name__)
 
-    vectorstore = FAISS.load_local("./././faiss_index", embeddings, allow_dangerous_deserialization=True)
-    retriever = vectorstore.as_retriever()
 
-    llm = ChatOpenAI(model="gpt-4")
+def query_reformulation(llm, query):
+    response = llm.predict("Rewrite this query to be more specific: " + query)
+    return response
 
-    retrieval_qa_chain = RetrievalQA.from_chain_type(
-        llm=llm,
-        retriever=retriever,
-        return_source_documents=True
-    )
 
-    search = TavilySearchResults(max_results=2)
-
-    def query_reformulation(query):
-        response = llm.predict("Rewrite this query to be more specific: " + query)
-        return response
-
-    def self_evaluate(input_text):
-        parts = input_text.split("|||")
-        query = parts[0]
-        response = parts[1]
-        sources = parts[2] if len(parts) > 2 else ""
-
-        evaluation_prompt = f"""
-        Evaluate the following response to the query:
-    
-        QUERY: {query}
-        RESPONSE: {response}
-        SOURCES: {sources}
-    
-        Assess based on:
-        1. Factual accuracy (Does it match the sources?)
-        2. Completeness (Does it address all aspects of the query?)
-        3. Relevance (Is the information relevant to the query?)
-        4. Hallucination (Does it contain information not supported by sources?)
-    
-        Return a confidence score from 0-10 and explanation.
-        """
-
-        evaluation = llm.predict(evaluation_prompt)
-        return evaluation
+def build_evaluation_prompt(input_text):
+    parts = input_text.split("|||")
+    query = parts[0]
+    response = parts[1]
+    sources = parts[2] if len(parts) > 2 else ""
+
+    return f"""
+    Evaluate the following response to the query:
+
+    QUERY: {query}
+    RESPONSE: {response}
+    SOURCES: {sources}
+
+    Assess based on:
+    1. Factual accuracy (Does it match the sources?)
+    2. Completeness (Does it address all aspects of the query?)
+    3. Relevance (Is the information relevant to the query?)
+    4. Hallucination (Does it contain information not supported by sources?)
+
+    Explain your assessment, then end with a line of the form "Score: N",
+    where N is your confidence score from 0 to 10.
+    """
+
+
+def self_evaluate(llm, input_text):
+    evaluation = llm.predict(build_evaluation_prompt(input_text))
+    return evaluation
+
+
+class RetrievalContext:
+    """Collects the documents the agent retrieved while answering one query."""
+
+    def __init__(self):
+        self.documents = []
+        self._seen = set()
+
+    def add(self, documents):
+        for doc in documents:
+            key = (doc.page_content, json.dumps(doc.metadata, sort_keys=True, default=str))
+            if key not in self._seen:
+                self._seen.add(key)
+                self.documents.append(doc)
+
+    def sources(self):
+        return [{"content": doc.page_content, "metadata": doc.metadata} for doc in self.documents]
+
+    def sources_text(self):
+        return "\n".join(doc.page_content for doc in self.documents) or "No sources available"
+
 
+def build_agent(llm, retrieval_qa_chain, search, context=None, coroutines=None, memory=None):
+    # ``coroutines`` maps tool names to async implementations used by ``agent.arun``
+    coroutines = coroutines or {}
+
+    def article_retrieval(q):
+        result = retrieval_qa_chain({"query": q})
+        if context is not None:
+            context.add(result.get("source_documents", []))
+        return result["result"]
 
     tools = [
         Tool(
             name="Article Retrieval",
-            func=lambda q: retrieval_qa_chain({"query": q})["result"],
+            func=article_retrieval,
+            coroutine=coroutines.get("Article Retrieval"),
             description="Retrieve knowledge from the article database."
         ),
 
         Tool(
             name="Web search",
             func=search,
+            coroutine=coroutines.get("Web search"),
             description="If the requested information cannot be found in the documents, it specifies this and performs a web search."
         ),
         Tool(
             name="Query reformulation",
-            func=query_reformulation,
+            func=lambda q: query_reformulation(llm, q),
+            coroutine=coroutines.get("Query reformulation"),
             description="Reformulate a query to be more specific and targeted."
         )
     ]
 
-    memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
-
+    if memory is None:
+        memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
 
-    agent = initialize_agent(
+    return initialize_agent(
         tools=tools,
         llm=llm,
         agent=AgentType.STRUCTURED_CHAT_ZERO_SHOT_REACT_DESCRIPTION,
         verbose=True,
-        memory=memory
+        memory=memory,
+        # The structured chat prompt only sees the history through an explicit placeholder
+        agent_kwargs={
+            "memory_prompts": [MessagesPlaceholder(variable_name="chat_history")],
+            "input_variables": ["input", "agent_scratchpad", "chat_history"],
+        }
     )
 
 
-    def get_evaluated_response(query):
-        response = agent.run(query)
+def get_sourced_response(agent, context, query, callbacks=None):
+    response = agent.run(query, callbacks=callbacks)
+
+    # Sources are the documents the agent's own retrievals returned; no second chain call.
+    # The answer is evaluated later, off the request path (see evaluation.py).
+    return {
+        "query": query,
+        "answer": response,
+        "sources": context.sources(),
+        "sources_text": context.sources_text()
+    }
+
+
+def rag_with_internet_search(query_user, memory=None, document_ids=None):
+    """Answer ``query_user`` from the indexed documents and the web.
+
+    ``document_ids`` limits the document search to those documents' shards;
+    by default the library and every uploaded document are searched.
+    """
+    engine = get_engine()
+    context = RetrievalContext()
+    agent = build_agent(
+        engine.llm, engine.retrieval_qa_chain(document_ids), engine.search, context=context, memory=memory
+    )
+
+    tracer = TracingCallbackHandler()
+    try:
+        with stage("agent"):
+            return get_sourced_response(agent, context, query_user, callbacks=[tracer])
+    finally:
+        tracer.finish()
+
+
+async def arag_with_internet_search(query_user, memory=None, document_ids=None):
+    """Async variant of :func:`rag_with_internet_search`.
+
+    The documents for the user's question are retrieved while the agent makes
+    its first decision; when the agent asks Article Retrieval for that same
+    question, only the QA step runs on them. Retrieval is local, so a prefetch
+    the agent never uses costs little; the web search for the question is only
+    prefetched as well with ``RAG_PREFETCH_WEB_SEARCH``, since it is a paid call.
+    Prefetches the agent never asks for are cancelled.
+    """
+    engine = get_engine()
+    # Opening the shards may load indexes from disk
+    retrieval_qa_chain = await sync_to_async(engine.retrieval_qa_chain, thread_sensitive=False)(document_ids)
+    llm = engine.llm
+    context = RetrievalContext()
+    tracer = TracingCallbackHandler()
+
+    retriever = retrieval_qa_chain.retriever
+    retrieval = asyncio.ensure_future(retriever.aget_relevant_documents(query_user, callbacks=[tracer]))
+    web_search = None
+    if getattr(settings, "RAG_PREFETCH_WEB_SEARCH", False):
+        web_search = asyncio.ensure_future(engine.search.ainvoke(query_user))
+
+    def is_user_query(q):
+        return normalize_query(str(q)) == normalize_query(query_user)
+
+    async def article_retrieval(q):
+        if not is_user_query(q):
+            result = await retrieval_qa_chain.acall({"query": q}, callbacks=[tracer])
+            context.add(result.get("source_documents", []))
+            return result["result"]
+        documents = await asyncio.shield(retrieval)
+        context.add(documents)
+        return await retrieval_qa_chain.combine_documents_chain.arun(
+            input_documents=documents, question=q, callbacks=[tracer]
+        )
+
+    async def web_search_tool(q):
+        if web_search is not None and is_user_query(q):
+            return await asyncio.shield(web_search)
+        return await engine.search.ainvoke(q)
+
+    async def reformulate(q):
+        return await llm.apredict("Rewrite this query to be more specific: " + q)
+
+    agent = build_agent(llm, retrieval_qa_chain, engine.search, context=context, memory=memory, coroutines={
+        "Article Retrieval": article_retrieval,
+        "Web search": web_search_tool,
+        "Query reformulation": reformulate,
+    })
+
+    try:
+        with stage("agent"):
+            response = await agent.arun(query_user, callbacks=[tracer])
+    finally:
+        tracer.finish()
+        for task in (retrieval, web_search):
+            if task is None:
+                continue
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()  # mark a failed prefetch as retrieved
+
+    return {
+        "query": query_user,
+        "answer": response,
+        "sources": context.sources(),
+        "sources_text": context.sources_text()
+    }
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """Times the LLM, retriever and tool runs of one agent invocation.
+
+    Pass it in ``callbacks`` of the agent call so every nested run reports to it,
+    then call :meth:`finish` once the answer is complete to record token and
+    tool-call counts.
+    """
+
+    def __init__(self):
+        self._started: Dict = {}
+        self._lock = threading.Lock()
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.llm_calls = 0
+        self.tool_calls: Dict[str, int] = {}
+
+    def _start(self, run_id, name: str):
+        with self._lock:
+            self._started[run_id] = (name, time.perf_counter())
+
+    def _end(self, run_id):
+        with self._lock:
+            started = self._started.pop(run_id, None)
+        if started is not None:
+            name, at = started
+            record(name, time.perf_counter() - at)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id, "llm")
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id, "llm")
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end(run_id)
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        with self._lock:
+            self.llm_calls += 1
+            self.prompt_tokens += usage.get("prompt_tokens", 0)
+            self.completion_tokens += usage.get("completion_tokens", 0)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        self._start(run_id, "retrieval")
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id)
 
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        tool = stage_name((serialized or {}).get("name", "tool"))
+        with self._lock:
+            self.tool_calls[tool] = self.tool_calls.get(tool, 0) + 1
+        self._start(run_id, f"tool.{tool}")
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def finish(self):
+        LLM_CALLS.observe(self.llm_calls)
+        if self.prompt_tokens or self.completion_tokens:
+            LLM_TOKENS.observe(self.prompt_tokens, kind="prompt")
+            LLM_TOKENS.observe(self.completion_tokens, kind="completion")
+        for tool, count in self.tool_calls.items():
+            TOOL_CALLS.observe(count, tool=tool)
+        logger.info(
+            f"RAG answer: {self.llm_calls} LLM calls, {self.prompt_tokens}+{self.completion_tokens} tokens, "
+            f"tool calls {self.tool_calls}"
+        )
+
+
+class FinalAnswerStreamHandler(BaseCallbackHandler):
+    """Forwards only the tokens of the agent's final answer to ``on_token``.
+
+    The structured chat agent replies with a JSON action blob; everything before
+    ``"action_input": "`` of a ``Final Answer`` action is the agent's scratchpad.
+    """
+
+    FINAL_ANSWER = re.compile(r'"action"\s*:\s*"Final Answer"\s*,\s*"action_input"\s*:\s*"')
+
+    def __init__(self, on_token):
+        self.on_token = on_token
+        self._buffer = ""
+        self._answer_start = None
+        self._emitted = 0
+        self._finished = False
+
+    def on_llm_start(self, *args, **kwargs):
+        self._buffer = ""
+        self._answer_start = None
+        self._emitted = 0
+
+    def on_chat_model_start(self, *args, **kwargs):
+        self.on_llm_start()
+
+    def on_llm_new_token(self, token, **kwargs):
+        if self._finished:
+            return
+        self._buffer += token
+        if self._answer_start is None:
+            match = self.FINAL_ANSWER.search(self._buffer)
+            if match is None:
+                return
+            self._answer_start = match.end()
+        raw = self._buffer[self._answer_start:]
+        # Stop at the closing quote; hold back a trailing backslash until its escape completes
+        end = re.search(r'(?<!\\)"', raw)
+        if end is not None:
+            raw = raw[:end.start()]
+            self._finished = True
+        elif raw.endswith("\\"):
+            raw = raw[:-1]
         try:
-            result = retrieval_qa_chain({"query": query})
-            sources = [doc.page_content for doc in result.get("source_documents", [])]
-            sources_text = "\n".join(sources)
-        except Exception as e:
-            sources_text = "No sources available"
+            text = json.loads(f'"{raw}"') if raw else ""
+        except ValueError:
+            # An escape sequence such as \u00e9 is still incomplete
+            return
+        if len(text) > self._emitted:
+            self.on_token(text[self._emitted:])
+            self._emitted = len(text)
 
-        evaluation = self_evaluate(f"{query}|||{response}|||{sources_text}")
 
-        return {
-            "query": query,
-            "response": response,
-            "evaluation": evaluation,
-            "sources": sources_text
-        }
+def stream_rag_with_internet_search(query_user, memory=None, document_ids=None) -> Iterator[Tuple[str, Any]]:
+    """Run the RAG pipeline and yield ``(event, data)`` pairs as they become available.
 
+    Events are ``token`` (final answer text as it is generated), ``answer`` and
+    ``sources``; the ``sources`` payload carries the sources list and text.
+    """
+    engine = get_engine()
+    context = RetrievalContext()
+    agent = build_agent(
+        engine.streaming_llm, engine.retrieval_qa_chain(document_ids), engine.search, context=context, memory=memory
+    )
 
-    def transparent_response(query):
-        result = get_evaluated_response(query)
+    events = queue.Queue()
+    done = object()
 
-        return f"""
-        Response: {result['response']}
-    
-        Confidence assessment: {result['evaluation']}
-        """
+    def run():
+        tracer = TracingCallbackHandler()
+        try:
+            handler = FinalAnswerStreamHandler(lambda token: events.put(("token", token)))
+            # The agent runs in its own thread, so its LLM deadline is set here
+            with stage("agent"), request_deadline():
+                response = agent.run(query_user, callbacks=[handler, tracer])
+            events.put(("answer", response))
+            events.put(("sources", {"sources": context.sources(), "sources_text": context.sources_text()}))
+        except Exception as e:
+            events.put(("error", str(e)))
+        finally:
+            tracer.finish()
+            events.put(done)
 
-    return transparent_response(query_user)
+    # The request's trace travels with the context into the agent thread
+    threading.Thread(target=contextvars.copy_context().run, args=(run,), daemon=True).start()
+    while (event := events.get()) is not done:
+        yield event
 
 
 if __name__ == '__main__':
-    convert_text_to_vec_db(folder_pdf_files)
+    from .find_pdf_files import convert_text_to_vec_db
+    convert_text_to_vec_db(os.getenv("FOLDER_PDF_FILES"))
     #rag_()
 
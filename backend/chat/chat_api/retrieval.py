@@ -0,0 +1,193 @@
+import heapq
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from django.conf import settings
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from .lexical import tokenize
+from .tracing import stage
+
+logger = logging.getLogger(__name__)
+
+RETRIEVAL_MODES = ("hybrid", "vector", "lexical")
+
+IDENTIFIER_PATTERN = re.compile(r"^(?=.*\d)[\w./-]+$|^[A-Z][A-Z0-9]+$")
+
+
+def is_exact_lookup(query: str, max_terms: int = 4) -> bool:
+    """Whether ``query`` is a short lookup of exact terms (part numbers, acronyms, a quoted phrase).
+
+    Such queries gain nothing from an embedding: the lexical index finds them
+    directly, while semantic search tends to return merely similar chunks.
+    """
+    query = query.strip()
+    if len(query) > 2 and query[0] == query[-1] == '"':
+        return True
+    terms = tokenize(query)
+    return 0 < len(terms) <= max_terms and all(IDENTIFIER_PATTERN.match(term) for term in terms)
+
+
+def reciprocal_rank_fusion(rankings: List[List[Hashable]], k: int = 60) -> List[Hashable]:
+    """Merge several best-first id lists; an id scores ``sum(1 / (k + rank))`` over the lists."""
+    scores: Dict[Hashable, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=lambda doc_id: scores[doc_id], reverse=True)
+
+
+class Shard:
+    """One searchable index: a FAISS vectorstore with its lexical index."""
+
+    def __init__(self, vectorstore, lexical, name: str = "library"):
+        self.vectorstore = vectorstore
+        self.lexical = lexical
+        self.name = name
+
+    def vector_hits(self, vector: np.ndarray, k: int) -> List[Tuple[float, str]]:
+        """Up to ``k`` ``(distance, doc_id)`` pairs; lower distance is better for every metric."""
+        if getattr(self.vectorstore, "_normalize_L2", False):
+            vector = vector.copy()
+            faiss.normalize_L2(vector)
+        index = self.vectorstore.index
+        distances, indices = index.search(vector, k)
+        sign = -1.0 if index.metric_type == faiss.METRIC_INNER_PRODUCT else 1.0
+        return [
+            (sign * float(distance), self.vectorstore.index_to_docstore_id[i])
+            for distance, i in zip(distances[0], indices[0]) if i != -1
+        ]
+
+    def lexical_hits(self, query: str, k: int) -> List[Tuple[float, str]]:
+        """Up to ``k`` ``(bm25, doc_id)`` pairs; lower is better, and only comparable within this shard."""
+        return [(score, doc_id) for doc_id, score in self.lexical.search(query, k)]
+
+
+_search_executor: Optional[ThreadPoolExecutor] = None
+_search_executor_lock = threading.Lock()
+
+
+def get_search_executor() -> ThreadPoolExecutor:
+    global _search_executor
+    if _search_executor is None:
+        with _search_executor_lock:
+            if _search_executor is None:
+                _search_executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, "RAG_SHARD_SEARCH_WORKERS", 4),
+                    thread_name_prefix="shard-search",
+                )
+    return _search_executor
+
+
+def fan_out(function: Callable, items: List) -> List:
+    """``[function(item) for item in items]``, run on the search pool when there is more than one item."""
+    if len(items) <= 1:
+        return [function(item) for item in items]
+    return list(get_search_executor().map(function, items))
+
+
+def merge_hits(hits_per_shard: List[List[Tuple[float, str]]], k: int) -> List[Tuple[int, str]]:
+    """The ``k`` best ``(shard, doc_id)`` keys over all shards' score-sorted hits.
+
+    Only for scores comparable across shards, such as vector distances.
+    """
+    merged = heapq.merge(
+        *[[(score, shard, doc_id) for score, doc_id in hits] for shard, hits in enumerate(hits_per_shard)]
+    )
+    return [(shard, doc_id) for _, shard, doc_id in islice(merged, k)]
+
+
+def merge_ranks(hits_per_shard: List[List[Tuple[float, str]]], k: int, rrf_k: int = 60) -> List[Tuple[int, str]]:
+    """The ``k`` best ``(shard, doc_id)`` keys, fusing each shard's ranking by :func:`reciprocal_rank_fusion`.
+
+    For scores that are not comparable across shards: BM25 depends on each
+    shard's own term and length statistics.
+    """
+    rankings = [[(shard, doc_id) for _, doc_id in hits] for shard, hits in enumerate(hits_per_shard)]
+    return reciprocal_rank_fusion(rankings, k=rrf_k)[:k]
+
+
+class HybridRetriever(BaseRetriever):
+    """Retrieves chunks from the FAISS and lexical indexes of one or more shards, fused by rank.
+
+    Each shard is searched in parallel and the hits are merged before fusion,
+    so the result is the global top-k rather than a per-shard one: vector hits
+    by distance, lexical hits by their rank within each shard, since BM25 scores
+    from different shards are not comparable. The query is embedded once for
+    all shards.
+
+    In ``hybrid`` mode, queries that look like exact-term lookups are answered
+    from the lexical index alone, skipping the embedding round-trip; when that
+    finds nothing they fall back to the fused search.
+
+    With a ``compressor``, ``candidates`` chunks are retrieved instead of ``k``
+    and the compressor picks and trims the ones passed on to the LLM.
+    """
+
+    shards: List[Any]
+    embeddings: Any
+    k: int = 4
+    fetch_k: int = 20
+    rrf_k: int = 60
+    mode: str = "hybrid"
+    compressor: Optional[Any] = None
+    candidates: int = 20
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def vector_search(self, query: str, k: int) -> List[Tuple[int, str]]:
+        vector = np.asarray([self.embeddings.embed_query(query)], dtype=np.float32)
+        return merge_hits(fan_out(lambda shard: shard.vector_hits(vector, k), self.shards), k)
+
+    def lexical_search(self, query: str, k: int) -> List[Tuple[int, str]]:
+        return merge_ranks(fan_out(lambda shard: shard.lexical_hits(query, k), self.shards), k, self.rrf_k)
+
+    def _documents(self, keys: List[Tuple[int, str]]) -> List[Document]:
+        documents = []
+        for shard, doc_id in keys:
+            document = self.shards[shard].vectorstore.docstore.search(doc_id)
+            if isinstance(document, Document):
+                documents.append(document)
+        return documents
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        if not self.shards:
+            return []
+        if self.compressor is None:
+            return self._documents(self.ranked_ids(query, self.k))
+        with stage("rerank"):
+            return self.compressor.compress(query, self._documents(self.ranked_ids(query, self.candidates)))
+
+    def ranked_ids(self, query: str, k: int) -> List[Tuple[int, str]]:
+        """The ``k`` best ``(shard, doc_id)`` keys for ``query``, best first."""
+        if self.mode == "vector":
+            return self.vector_search(query, k)
+        if self.mode == "lexical":
+            return self.lexical_search(query, k)
+
+        if is_exact_lookup(query):
+            lexical_ids = self.lexical_search(query, k)
+            if lexical_ids:
+                logger.debug(f"Lexical-only retrieval for {query!r}: {len(lexical_ids)} chunks")
+                return lexical_ids
+
+        fetch_k = max(self.fetch_k, k)
+        lexical_ids = self.lexical_search(query, fetch_k)
+        vector_ids = self.vector_search(query, fetch_k)
+        fused = reciprocal_rank_fusion([vector_ids, lexical_ids], k=self.rrf_k)[:k]
+        logger.debug(
+            f"Hybrid retrieval for {query!r} over {len(self.shards)} shards: {len(vector_ids)} vector, "
+            f"{len(lexical_ids)} lexical, {len(fused)} fused chunks"
+        )
+        return fused
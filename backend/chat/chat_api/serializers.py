@@ -1,29 +1,88 @@
 from rest_framework import serializers
-from .models import Document, Chat, Message
+from .models import Document, DocumentChunk, IngestionJob, Chat, Message, MessageEvaluation
+
+LAST_MESSAGE_PREVIEW_LENGTH = 200
 
 class DocumentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Document
         fields = '__all__'
-        read_only_fields = ('created_at', 'updated_at', 'vectorstore_path')
+        read_only_fields = ('created_at', 'updated_at', 'vectorstore_path', 'file', 'status', 'error', 'page_count')
+
+class DocumentUploadSerializer(serializers.Serializer):
+    file = serializers.FileField()
+    title = serializers.CharField(max_length=255, required=False)
+
+    def validate_file(self, value):
+        if not value.name.lower().endswith('.pdf'):
+            raise serializers.ValidationError("Only PDF files can be uploaded.")
+        if value.read(5) != b'%PDF-':
+            raise serializers.ValidationError("The file is not a PDF.")
+        value.seek(0)
+        return value
+
+class DocumentChunkSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DocumentChunk
+        fields = ['id', 'document', 'position', 'page', 'content']
+        read_only_fields = fields
+
+class IngestionJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = IngestionJob
+        fields = [
+            'id', 'document', 'status', 'chunks_done', 'chunks_total', 'chunk_stats', 'attempts', 'error',
+            'created_at', 'updated_at', 'completed_at',
+        ]
+        read_only_fields = fields
+
+class MessageEvaluationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = MessageEvaluation
+        fields = ['id', 'message', 'status', 'confidence_score', 'explanation', 'created_at', 'completed_at']
+        read_only_fields = fields
 
 class MessageSerializer(serializers.ModelSerializer):
+    evaluation = serializers.SerializerMethodField()
+
     class Meta:
         model = Message
-        fields = ['id', 'chat', 'content', 'is_user', 'created_at']
+        fields = ['id', 'chat', 'content', 'is_user', 'evaluation', 'created_at']
         read_only_fields = ('created_at',)
 
+    def get_evaluation(self, obj):
+        evaluation = getattr(obj, 'evaluation', None)
+        if evaluation:
+            return MessageEvaluationSerializer(evaluation).data
+        return None
+
 class ChatSerializer(serializers.ModelSerializer):
-    messages = MessageSerializer(many=True, read_only=True)
     last_message = serializers.SerializerMethodField()
+    documents = serializers.PrimaryKeyRelatedField(many=True, required=False, queryset=Document.objects.all())
 
     class Meta:
         model = Chat
-        fields = ['id', 'title', 'messages', 'last_message', 'created_at', 'updated_at']
+        fields = ['id', 'title', 'documents', 'last_message', 'created_at', 'updated_at']
         read_only_fields = ('created_at', 'updated_at')
 
     def get_last_message(self, obj):
+        # ChatViewSet annotates the last message onto each chat; fall back to a
+        # query for instances that did not come from that queryset.
+        if hasattr(obj, 'last_message_id'):
+            if obj.last_message_id is None:
+                return None
+            return {
+                'id': obj.last_message_id,
+                'content': obj.last_message_content,
+                'is_user': obj.last_message_is_user,
+                'created_at': serializers.DateTimeField().to_representation(obj.last_message_created_at),
+            }
         last_message = obj.messages.order_by('-created_at').first()
         if last_message:
-            return MessageSerializer(last_message).data
-        return None 
\ No newline at end of file
+            return {
+                'id': last_message.id,
+                'content': last_message.content[:LAST_MESSAGE_PREVIEW_LENGTH],
+                'is_user': last_message.is_user,
+                'created_at': serializers.DateTimeField().to_representation(last_message.created_at),
+            }
+        return None
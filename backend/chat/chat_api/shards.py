@@ -0,0 +1,134 @@
+import logging
+import os
+import re
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from .index_store import index_signature, read_index
+from .lexical import LexicalIndex
+from .retrieval import Shard
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_SHARD_PATTERN = re.compile(r"^document-(\d+)$")
+# Every document's chunks merged into one shard, searched by chats not scoped to particular documents
+COLLECTION_SHARD = "collection"
+# Replaced whenever a document shard is written or removed, so other processes notice
+GENERATION_FILE = "GENERATION"
+
+
+def get_shard_root() -> str:
+    return str(getattr(settings, "FAISS_SHARD_ROOT", "./././faiss_shards"))
+
+
+def document_shard_path(document_id) -> str:
+    return os.path.join(get_shard_root(), f"document-{document_id}")
+
+
+def collection_path() -> str:
+    return os.path.join(get_shard_root(), COLLECTION_SHARD)
+
+
+def document_shard_ids() -> List[int]:
+    """Ids of the documents that have a shard on disk."""
+    try:
+        entries = os.scandir(get_shard_root())
+    except FileNotFoundError:
+        return []
+    with entries:
+        return sorted(
+            int(match.group(1))
+            for entry in entries
+            if entry.is_dir() and (match := DOCUMENT_SHARD_PATTERN.match(entry.name))
+        )
+
+
+def shard_generation() -> Optional[Tuple[int, int]]:
+    """Cheap fingerprint of the set of document shards; changes whenever one is written or removed."""
+    try:
+        stat = os.stat(os.path.join(get_shard_root(), GENERATION_FILE))
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def bump_shard_generation():
+    root = get_shard_root()
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, GENERATION_FILE)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "w") as f:
+        f.write(uuid.uuid4().hex)
+    # A new inode every time, so the fingerprint changes even within one mtime tick
+    os.replace(temp_path, path)
+
+
+def remove_document_shard(document_id):
+    path = document_shard_path(document_id)
+    shutil.rmtree(path, ignore_errors=True)
+    try:
+        os.remove(f"{path}.lock")
+    except FileNotFoundError:
+        pass
+    bump_shard_generation()
+
+
+def load_shard(path: str, embeddings) -> Shard:
+    vectorstore = read_index(
+        path,
+        embeddings,
+        mmap=getattr(settings, "FAISS_INDEX_MMAP", True),
+        params=getattr(settings, "FAISS_INDEX_PARAMS", None),
+    )
+    return Shard(vectorstore, LexicalIndex.load(path, vectorstore), name=os.path.basename(path))
+
+
+class ShardCache:
+    """LRU of open document shards, reloaded when their files change on disk.
+
+    A shard is opened on first use; beyond ``max_open`` shards the least
+    recently used one is dropped. Queries still holding a dropped shard finish
+    against it; its memory maps and connections go with its last reference.
+    """
+
+    def __init__(self, embeddings, max_open: int = 32):
+        self.embeddings = embeddings
+        self.max_open = max_open
+        self.hits = 0
+        self.misses = 0
+        self._shards: "OrderedDict[str, Tuple[Tuple, Shard]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> Optional[Shard]:
+        signature = index_signature(path)
+        with self._lock:
+            if signature is None:
+                # Missing, or a writer is mid-swap; skip it for this query
+                self._shards.pop(path, None)
+                return None
+            entry = self._shards.get(path)
+            if entry is not None and entry[0] == signature:
+                self._shards.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        try:
+            shard = load_shard(path, self.embeddings)
+        except Exception as e:
+            logger.error(f"Error loading index shard {path}: {str(e)}")
+            return None
+        with self._lock:
+            self._shards[path] = (signature, shard)
+            self._shards.move_to_end(path)
+            while len(self._shards) > self.max_open:
+                evicted, _ = self._shards.popitem(last=False)
+                logger.debug(f"Closed index shard {evicted}")
+        return shard
+
+    def stats(self) -> Dict[str, int]:
+        return {"open": len(self._shards), "max_open": self.max_open, "hits": self.hits, "misses": self.misses}
@@ -1,3 +1,250 @@
-from django.test import TestCase
+import asyncio
+import os
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from langchain_community.chat_models.fake import FakeListChatModel
+
+from . import ingestion
+from .answer_cache import AnswerCache
+from .embeddings import HashingEmbeddings
+from .evaluation import parse_confidence_score
+from .llm import ConcurrencyLimiter, LLMUnavailable, SingleFlight, request_deadline
+from .memory import build_chat_memory
+from .models import Chat, Document, DocumentChunk, IngestionJob, Message
+from .retrieval import merge_ranks
+from .shards import bump_shard_generation, document_shard_path, remove_document_shard, shard_generation
+from .web_search import CircuitBreaker, StubSearchBackend, WebSearchTool
+
+
+class HangingSearchBackend(StubSearchBackend):
+    async def _arun(self, query: str, run_manager=None):
+        await asyncio.Event().wait()
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def test_cancelled_trial_is_released(self):
+        breaker = CircuitBreaker(failure_threshold=1, cooldown=0.0)
+        breaker.record_failure()
+        tool = WebSearchTool(backend=HangingSearchBackend(), timeout=5.0, breaker=breaker)
+
+        async def cancel_trial():
+            task = asyncio.ensure_future(tool.ainvoke("alpha"))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(cancel_trial())
+        self.assertTrue(breaker.is_open)
+        self.assertTrue(breaker.allow())
+
+
+class ConfidenceScoreTests(SimpleTestCase):
+    def test_numbered_criteria_are_not_scores(self):
+        text = "1. Factual accuracy: matches the sources.\n2. Completeness: full.\nConfidence score: 8"
+        self.assertEqual(parse_confidence_score(text), 8.0)
+
+    def test_score_line(self):
+        self.assertEqual(parse_confidence_score("Mostly supported.\nScore: 7.5"), 7.5)
+        self.assertEqual(parse_confidence_score("I would rate it 6 out of 10."), 6.0)
+
+    def test_no_score(self):
+        self.assertIsNone(parse_confidence_score("1. Accurate. 2. Complete."))
+
+
+class ShardGenerationTests(SimpleTestCase):
+    def test_changes_on_every_write_and_removal(self):
+        with tempfile.TemporaryDirectory() as root, override_settings(FAISS_SHARD_ROOT=root):
+            self.assertIsNone(shard_generation())
+            bump_shard_generation()
+            first = shard_generation()
+            remove_document_shard(1)
+            self.assertIsNotNone(first)
+            self.assertNotEqual(shard_generation(), first)
+
+
+class AnswerCacheTests(SimpleTestCase):
+    def test_entries_are_dropped_when_a_shard_changes(self):
+        with tempfile.TemporaryDirectory() as root, \
+                override_settings(FAISS_SHARD_ROOT=root, FAISS_INDEX_PATH=os.path.join(root, "library")):
+            cache = AnswerCache(HashingEmbeddings(64))
+            cache.store("What is RAG?", {"answer": "Retrieval augmented generation"})
+            self.assertEqual(cache.lookup("what is rag")[1]["match"], "exact")
+            bump_shard_generation()
+            self.assertEqual(cache.lookup("what is rag"), (None, None))
+            self.assertEqual(cache.stats()["size"], 0)
+
+
+class MergeRanksTests(SimpleTestCase):
+    def test_small_shard_does_not_outrank_by_raw_score(self):
+        library = [(-12.0, "lib-1"), (-11.0, "lib-2")]
+        document = [(-30.0, "doc-1"), (-29.0, "doc-2")]
+        self.assertEqual(
+            merge_ranks([library, document], k=4),
+            [(0, "lib-1"), (1, "doc-1"), (0, "lib-2"), (1, "doc-2")],
+        )
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_follower_takes_over_from_a_cancelled_leader(self):
+        flight = SingleFlight()
+
+        async def cancel_leader():
+            started = asyncio.Event()
+
+            async def hang():
+                started.set()
+                await asyncio.Event().wait()
+
+            async def answer():
+                return "answer"
+
+            leader = asyncio.ensure_future(flight.ado("query", hang))
+            await started.wait()
+            follower = asyncio.ensure_future(flight.ado("query", answer))
+            await asyncio.sleep(0)
+            leader.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await leader
+            self.assertEqual(await asyncio.wait_for(follower, 1.0), "answer")
+
+        asyncio.run(cancel_leader())
+        self.assertEqual(flight.stats(), {"calls": 2, "coalesced": 1, "in_flight": 0})
+
+
+class ConcurrencyLimiterTests(SimpleTestCase):
+    def test_waiting_coroutine_gets_the_released_slot(self):
+        limiter = ConcurrencyLimiter(max_concurrent=1, max_waiting=1)
+
+        async def hold_then_queue():
+            await limiter.aacquire()
+            waiter = asyncio.ensure_future(limiter.aacquire())
+            await asyncio.sleep(0)
+            self.assertEqual(limiter.waiting, 1)
+            limiter.release()
+            await asyncio.wait_for(waiter, 1.0)
+            self.assertEqual((limiter.active, limiter.waiting), (1, 0))
+            limiter.release()
+
+        asyncio.run(hold_then_queue())
+        self.assertEqual(limiter.active, 0)
+
+    def test_queue_wait_ends_at_the_deadline(self):
+        limiter = ConcurrencyLimiter(max_concurrent=1, max_waiting=1)
+        limiter.acquire()
+        started = time.monotonic()
+        with request_deadline(0.05), self.assertRaises(LLMUnavailable):
+            limiter.acquire()
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(limiter.stats()["timed_out"], 1)
+
+
+class SummaryRecorder(FakeListChatModel):
+    """Answers with ``responses`` and records which messages each summary was asked to fold in."""
+
+    summarized: list = []
+
+    def _call(self, messages, *args, **kwargs):
+        lines = messages[-1].content.split("NEW LINES OF CONVERSATION:")[1].split("NEW SUMMARY:")[0]
+        self.summarized.append([line.split()[1] for line in lines.strip().splitlines()])
+        return super()._call(messages, *args, **kwargs)
+
+
+class ChatMemoryTests(TestCase):
+    def test_backlog_is_summarized_oldest_first(self):
+        chat = Chat.objects.create(title="Backlog")
+        started = timezone.now()
+        for i in range(12):
+            message = Message.objects.create(chat=chat, content=f"m{i} " + "word " * 20, is_user=i % 2 == 0)
+            Message.objects.filter(id=message.id).update(created_at=started + timedelta(seconds=i))
+        llm = SummaryRecorder(responses=["first", "second", "third", "fourth"])
+
+        with override_settings(MEMORY_MAX_UNSUMMARIZED_MESSAGES=4):
+            for _ in range(4):
+                memory = build_chat_memory(chat, max_tokens=60, llm=llm)
+                chat.refresh_from_db()
+
+        self.assertEqual(llm.summarized[:2], [["m0", "m1", "m2", "m3"], ["m4", "m5", "m6", "m7"]])
+        window = [message.content.split()[0] for message in memory.chat_memory.messages[1:]]
+        oldest_in_window = int(window[0][1:])
+        summarized = [name for batch in llm.summarized for name in batch]
+        # Every message older than the window was summarized exactly once, and nothing after it
+        self.assertEqual(summarized, [f"m{i}" for i in range(oldest_in_window)])
+        self.assertEqual(window, [f"m{i}" for i in range(oldest_in_window, 12)])
+        first_in_window = Message.objects.get(chat=chat, content__startswith=f"{window[0]} ")
+        self.assertLess(chat.summarized_until, first_in_window.created_at)
+
+
+class RecordingEmbeddings(HashingEmbeddings):
+    """Hashing embeddings that record the texts they embed and fail once ``fail_after`` have been."""
+
+    def __init__(self, fail_after=None):
+        super().__init__(64)
+        self.embedded = []
+        self.fail_after = fail_after
+
+    def embed_documents(self, texts):
+        if self.fail_after is not None and len(self.embedded) >= self.fail_after:
+            raise RuntimeError("Embedding service unavailable")
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+
+class IngestionTests(TestCase):
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        settings = override_settings(
+            FAISS_SHARD_ROOT=root.name, DOCUMENT_INGESTION_IN_PROCESS=False,
+            DOCUMENT_INGESTION_BATCH_SIZE=2, DOCUMENT_INGESTION_RETRIES=0,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.document = Document.objects.create(title="Words", content=" ".join(f"word{i}" for i in range(1200)))
+
+    def run_job(self, job, embeddings):
+        with mock.patch.object(ingestion, "get_embeddings", lambda: embeddings), \
+                mock.patch("chat_api.indexing.get_embeddings", lambda: embeddings):
+            return ingestion.run_ingestion(job.id)
+
+    def test_retried_job_resumes_after_its_last_embedded_batch(self):
+        job = ingestion.start_ingestion(self.document)
+        self.assertFalse(self.run_job(job, RecordingEmbeddings(fail_after=2)))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.chunks_done), (IngestionJob.STATUS_FAILED, 2))
+        self.assertGreater(job.chunks_total, 2)
+
+        self.assertTrue(ingestion.retry_job(job))
+        embeddings = RecordingEmbeddings()
+        self.assertTrue(self.run_job(job, embeddings))
+        job.refresh_from_db()
+        chunks = list(DocumentChunk.objects.filter(document=self.document).order_by('position'))
+        self.assertEqual(embeddings.embedded, [chunk.content for chunk in chunks[2:]])
+        self.assertEqual((job.status, job.chunks_done), (IngestionJob.STATUS_DONE, job.chunks_total))
+        self.assertEqual(Document.objects.get(id=self.document.id).status, Document.STATUS_READY)
+        self.assertTrue(os.path.isdir(document_shard_path(self.document.id)))
+
+    def test_superseded_job_stops_and_leaves_the_document_to_the_new_one(self):
+        job = ingestion.start_ingestion(self.document)
+        embed = ingestion.embed_with_retries
+
+        def supersede(embeddings, texts):
+            ingestion.start_ingestion(Document.objects.get(id=self.document.id))
+            return embed(embeddings, texts)
+
+        with mock.patch.object(ingestion, "embed_with_retries", supersede):
+            self.assertFalse(self.run_job(job, RecordingEmbeddings()))
+        job.refresh_from_db()
+        self.assertEqual(job.status, IngestionJob.STATUS_FAILED)
+        self.assertFalse(ingestion.retry_job(job))
+        self.assertFalse(os.path.isdir(document_shard_path(self.document.id)))
+
+        newer = IngestionJob.objects.filter(document=self.document).latest('id')
+        self.assertEqual(Document.objects.get(id=self.document.id).status, Document.STATUS_PENDING)
+        self.assertTrue(self.run_job(newer, RecordingEmbeddings()))
+        self.assertEqual(Document.objects.get(id=self.document.id).status, Document.STATUS_READY)
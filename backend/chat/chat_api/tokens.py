@@ -0,0 +1,23 @@
+import logging
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Kept free of Django models: chunking imports it in the PDF extraction worker processes
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+        return tiktoken.encoding_for_model("gpt-4")
+    except Exception as e:
+        logger.warning(f"tiktoken unavailable, estimating token counts: {str(e)}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    encoding = _encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))
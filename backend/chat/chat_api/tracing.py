@@ -0,0 +1,206 @@
+import contextvars
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 8, 13, 21)
+
+
+class Histogram:
+    """A Prometheus histogram with a fixed set of label names."""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _labels(self, key, extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: (list(buckets), total, count) for key, (buckets, total, count) in self._series.items()}
+        for key, (buckets, total, count) in sorted(series.items()):
+            for bound, bucket_count in zip(self.buckets, buckets):
+                le = f'le="{bound:g}"'
+                lines.append(f"{self.name}_bucket{self._labels(key, le)} {bucket_count}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{self._labels(key, le)} {count}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {total:g}")
+            lines.append(f"{self.name}_count{self._labels(key)} {count}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Histogram] = []
+
+    def register(self, metric: Histogram) -> Histogram:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self._metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_DURATION = REGISTRY.register(Histogram(
+    "chat_stage_duration_seconds", "Time spent in each stage of answering a message.", ["stage"]
+))
+REQUEST_DURATION = REGISTRY.register(Histogram(
+    "chat_request_duration_seconds", "HTTP request duration by view.", ["view", "method", "status"]
+))
+LLM_TOKENS = REGISTRY.register(Histogram(
+    "chat_rag_llm_tokens", "LLM tokens used per RAG answer.", ["kind"], buckets=TOKEN_BUCKETS
+))
+LLM_CALLS = REGISTRY.register(Histogram(
+    "chat_rag_llm_calls", "LLM round-trips per RAG answer.", buckets=COUNT_BUCKETS
+))
+CONTEXT_TOKENS = REGISTRY.register(Histogram(
+    "chat_rag_context_tokens", "Context tokens per query: the top-k chunks as retrieved, and what compression kept.", ["kind"],
+    buckets=TOKEN_BUCKETS
+))
+TOOL_CALLS = REGISTRY.register(Histogram(
+    "chat_rag_tool_calls", "Agent tool calls per RAG answer.", ["tool"], buckets=COUNT_BUCKETS
+))
+WARMUP_DURATION = REGISTRY.register(Histogram(
+    "chat_warmup_duration_seconds", "Time spent in each step of warming up a worker.", ["step"]
+))
+
+
+class Trace:
+    """Stage timings collected while serving one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: List[Tuple[str, float]] = []
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, duration: float):
+        with self._lock:
+            self.stages.append((stage, duration))
+
+    def totals(self) -> Dict[str, Tuple[float, int]]:
+        totals: Dict[str, Tuple[float, int]] = {}
+        with self._lock:
+            for stage, duration in self.stages:
+                total, count = totals.get(stage, (0.0, 0))
+                totals[stage] = (total + duration, count + 1)
+        return totals
+
+    def server_timing(self) -> str:
+        entries = [
+            f'{stage};dur={total * 1000:.1f};desc="{count}x"'
+            for stage, (total, count) in self.totals().items()
+        ]
+        entries.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(entries)
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("chat_trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def record(stage: str, duration: float):
+    STAGE_DURATION.observe(duration, stage=stage)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(stage, duration)
+
+
+@contextmanager
+def stage(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+def stage_name(name: str) -> str:
+    """A Server-Timing token for a tool or model name."""
+    return re.sub(r"[^a-z0-9]+", "_", name.lower()).strip("_")
+
+
+class ServerTimingMiddleware:
+    """Collects a :class:`Trace` per request, reports it in ``Server-Timing`` and the request histogram.
+
+    Streaming responses carry only the stages finished before the first byte;
+    their later stages still reach ``/metrics``.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        trace = Trace()
+        token = _current_trace.set(trace)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_trace.reset(token)
+        return self._finish(request, response, trace)
+
+    async def __acall__(self, request):
+        trace = Trace()
+        token = _current_trace.set(trace)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_trace.reset(token)
+        return self._finish(request, response, trace)
+
+    def _finish(self, request, response, trace: Trace):
+        response["Server-Timing"] = trace.server_timing()
+        match = getattr(request, "resolver_match", None)
+        REQUEST_DURATION.observe(
+            time.perf_counter() - trace.started,
+            view=match.view_name if match else "unmatched",
+            method=request.method,
+            status=response.status_code,
+        )
+        return response
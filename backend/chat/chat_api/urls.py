@@ -2,10 +2,11 @@ from django.contrib import admin
 from django.urls import path, include
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import DocumentViewSet, ChatViewSet
+from .views import DocumentViewSet, IngestionJobViewSet, ChatViewSet
 
 router = DefaultRouter()
 router.register(r'documents', DocumentViewSet, basename='document')
+router.register(r'ingestion-jobs', IngestionJobViewSet, basename='ingestionjob')
 router.register(r'chats', ChatViewSet, basename='chat')
 
 urlpatterns = [
@@ -1,79 +1,296 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.parsers import MultiPartParser
 from django.conf import settings
-from langchain.vectorstores import FAISS
-from langchain.embeddings import OpenAIEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.chat_models import ChatOpenAI
-from langchain.chains import ConversationalRetrievalChain
-from langchain.memory import ConversationBufferMemory
-from langchain.schema import HumanMessage
+from django.db import connections
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Substr
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from asgiref.sync import sync_to_async
+import asyncio
 import os
+import json
 import logging
-from .models import Document, Chat, Message
-from .serializers import DocumentSerializer, ChatSerializer, MessageSerializer
-from .rag_exp import rag_with_internet_search
+import math
+import threading
+from .models import Document, DocumentChunk, IngestionJob, Chat, Message, MessageEvaluation
+from .serializers import (
+    DocumentSerializer, DocumentUploadSerializer, DocumentChunkSerializer, IngestionJobSerializer, ChatSerializer,
+    MessageSerializer, MessageEvaluationSerializer, LAST_MESSAGE_PREVIEW_LENGTH
+)
+from .pagination import ChatCursorPagination, MessageCursorPagination, DocumentChunkCursorPagination
+from .tracing import REGISTRY, stage
+
+# The RAG pipeline (LangChain, FAISS, PyMuPDF) is imported inside the views that
+# use it, so loading the URLconf stays cheap; see warmup.py for preloading it.
 
 logger = logging.getLogger(__name__)
 
+
+def cached_rag_with_internet_search(query, memory=None, document_ids=None):
+    from .answer_cache import IN_FLIGHT_MATCH, get_answer_cache, normalize_query
+    from .rag_exp import rag_with_internet_search
+
+    # Answers to follow-up questions depend on the conversation, and answers of
+    # chats limited to some documents on the selection, so only context-free
+    # (first turn, unscoped) questions go through the answer cache
+    if document_ids is not None or (memory is not None and memory.chat_memory.messages):
+        return rag_with_internet_search(query, memory=memory, document_ids=document_ids), None
+    answer_cache = get_answer_cache()
+    with stage("answer_cache"):
+        result, cache_match = answer_cache.lookup(query)
+    if result is None:
+        answered = []
+
+        def answer():
+            answered.append(True)
+            result = rag_with_internet_search(query, memory=memory)
+            with stage("answer_cache"):
+                answer_cache.store(query, result)
+            return result
+
+        # Users asking the same question at the same time share one agent run
+        result = answer_cache.flight.do(normalize_query(query), answer)
+        if not answered:
+            cache_match = IN_FLIGHT_MATCH
+    return result, cache_match
+
+
+async def acached_rag_with_internet_search(query, memory=None, document_ids=None):
+    from .answer_cache import IN_FLIGHT_MATCH, get_answer_cache, normalize_query
+    from .rag_exp import arag_with_internet_search
+
+    if document_ids is not None or (memory is not None and memory.chat_memory.messages):
+        return await arag_with_internet_search(query, memory=memory, document_ids=document_ids), None
+    answer_cache = get_answer_cache()
+    with stage("answer_cache"):
+        result, cache_match = await sync_to_async(answer_cache.lookup, thread_sensitive=False)(query)
+    if result is None:
+        answered = []
+
+        async def answer():
+            answered.append(True)
+            result = await arag_with_internet_search(query, memory=memory)
+            with stage("answer_cache"):
+                await sync_to_async(answer_cache.store, thread_sensitive=False)(query, result)
+            return result
+
+        result = await answer_cache.flight.ado(normalize_query(query), answer)
+        if not answered:
+            cache_match = IN_FLIGHT_MATCH
+    return result, cache_match
+
+
+def llm_unavailable_response(error, response_class=Response):
+    """503 for a request the LLM layer could not serve within its deadline."""
+    response = response_class({"error": str(error)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    response['Retry-After'] = str(math.ceil(error.retry_after))
+    return response
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def iterate_in_thread(iterator):
+    # Under ASGI Django buffers synchronous iterators completely before sending
+    # them, so run the iterator on a thread of its own and yield its items
+    # asynchronously. One thread for the whole stream means the ORM work in it
+    # uses one database connection, closed when the stream ends.
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stopped = threading.Event()
+    done = object()
+
+    def put(item, error=None):
+        if stopped.is_set():
+            return
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, (item, error))
+        except RuntimeError:  # the event loop has shut down
+            pass
+
+    def produce():
+        try:
+            for item in iterator:
+                if stopped.is_set():
+                    break
+                put(item)
+            put(done)
+        except BaseException as e:
+            put(done, e)
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+            connections.close_all()
+
+    threading.Thread(target=produce, name="event-stream", daemon=True).start()
+    try:
+        while True:
+            item, error = await queue.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        # The client went away or the stream ended; the thread stops after its current item
+        stopped.set()
+
+
+class EventStreamRenderer(BaseRenderer):
+    # Lets clients ask for text/event-stream; only error payloads are rendered through it
+    media_type = 'text/event-stream'
+    format = 'sse'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return sse_event("error", data).encode()
+
+
 class DocumentViewSet(viewsets.ModelViewSet):
     queryset = Document.objects.all()
     serializer_class = DocumentSerializer
 
     def create(self, request, *args, **kwargs):
+        """Store a text document; it is split, embedded and indexed in the background."""
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        self.perform_create(serializer)
+        document = serializer.save(status=Document.STATUS_PENDING)
+        return self._ingest(request, document)
 
-        # Process document for RAG
-        document = serializer.instance
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
-        )
-        texts = text_splitter.split_text(document.content)
+    def _ingest(self, request, document):
+        from .ingestion import start_ingestion
+        job = start_ingestion(document)
+        location = reverse('ingestionjob-detail', args=[job.id], request=request)
+        return Response(IngestionJobSerializer(job).data, status=status.HTTP_202_ACCEPTED, headers={'Location': location})
 
-        try:
-            # Create embeddings and store in FAISS
-            embeddings = OpenAIEmbeddings(
-                openai_api_key=settings.OPENAI_API_KEY,
-                model="text-embedding-ada-002"
+    @action(detail=False, methods=['post'], url_path='upload', url_name='upload', parser_classes=[MultiPartParser])
+    def upload(self, request):
+        """Accept a PDF as a multipart upload; it is extracted and indexed in the background."""
+        max_bytes = getattr(settings, "DOCUMENT_UPLOAD_MAX_BYTES", 200 * 1024 * 1024)
+        if int(request.META.get('CONTENT_LENGTH') or 0) > max_bytes:
+            return Response(
+                {"error": f"Uploads are limited to {max_bytes} bytes"},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
             )
-            vectorstore = FAISS.from_texts(texts, embeddings)
+        # Stream the file to a temporary file on disk instead of buffering it in memory
+        request._request.upload_handlers = [TemporaryFileUploadHandler(request._request)]
 
-            # Save vectorstore path or handle storage as needed
-            document.vectorstore_path = f"vectorstores/{document.id}"
-            document.save()
+        upload = DocumentUploadSerializer(data=request.data)
+        upload.is_valid(raise_exception=True)
+        uploaded_file = upload.validated_data['file']
+        document = Document(
+            title=upload.validated_data.get('title') or os.path.splitext(uploaded_file.name)[0],
+            status=Document.STATUS_PENDING,
+        )
+        # Moves the temporary file into MEDIA_ROOT rather than copying it
+        document.file.save(uploaded_file.name, uploaded_file, save=False)
+        document.save()
+        return self._ingest(request, document)
 
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        except Exception as e:
-            logger.error(f"Error processing document: {str(e)}")
+    @action(detail=True, methods=['get'], url_path='chunks', url_name='chunks')
+    def chunks(self, request, pk=None):
+        document = self.get_object()
+        paginator = DocumentChunkCursorPagination()
+        page = paginator.paginate_queryset(DocumentChunk.objects.filter(document=document), request, view=self)
+        return paginator.get_paginated_response(DocumentChunkSerializer(page, many=True).data)
+
+    def perform_update(self, serializer):
+        content_changed = 'content' in serializer.validated_data or 'title' in serializer.validated_data
+        document = serializer.save()
+        if content_changed:
+            from .ingestion import start_ingestion
+            # Rebuild only this document's index shard, in the background
+            start_ingestion(document)
+
+    def perform_destroy(self, instance):
+        from .answer_cache import get_answer_cache
+        from .ingestion import delete_document_index
+
+        document_id = instance.id
+        if instance.file:
+            instance.file.delete(save=False)
+        # Deleting the row deletes its ingestion jobs, which stops one still running
+        instance.delete()
+        delete_document_index(document_id)
+        get_answer_cache().invalidate()
+
+
+class IngestionJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """Progress of background document ingestion."""
+    queryset = IngestionJob.objects.order_by('-created_at')
+    serializer_class = IngestionJobSerializer
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        document_id = self.request.query_params.get('document')
+        if document_id is not None:
+            queryset = queryset.filter(document_id=document_id)
+        return queryset
+
+    @action(detail=True, methods=['post'], url_path='retry', url_name='retry')
+    def retry(self, request, pk=None):
+        """Re-queue a failed job; it resumes after its last embedded batch."""
+        from .ingestion import retry_job
+
+        job = self.get_object()
+        if not retry_job(job):
             return Response(
-                {"error": f"Error processing document: {str(e)}"},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                {"error": "Only the latest failed job of a document can be retried"},
+                status=status.HTTP_409_CONFLICT
             )
+        job.refresh_from_db()
+        return Response(IngestionJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
 
 
 class ChatViewSet(viewsets.ModelViewSet):
     queryset = Chat.objects.all()
     serializer_class = ChatSerializer
+    pagination_class = ChatCursorPagination
+
+    def get_queryset(self):
+        # Annotate the last message so listing chats stays a single query
+        last_message = Message.objects.filter(chat=OuterRef('pk')).order_by('-created_at')
+        return Chat.objects.prefetch_related('documents').annotate(
+            last_message_id=Subquery(last_message.values('id')[:1]),
+            last_message_content=Subquery(
+                last_message.annotate(preview=Substr('content', 1, LAST_MESSAGE_PREVIEW_LENGTH)).values('preview')[:1]
+            ),
+            last_message_is_user=Subquery(last_message.values('is_user')[:1]),
+            last_message_created_at=Subquery(last_message.values('created_at')[:1]),
+        )
 
     def create(self, request, *args, **kwargs):
         data = request.data.copy()
-        if 'title' not in data:
-            data['title'] = f"New Chat {Chat.objects.count() + 1}"
+        generate_title = 'title' not in data
+        if generate_title:
+            data['title'] = "New Chat"
         
         serializer = self.get_serializer(data=data)
         serializer.is_valid(raise_exception=True)
         self.perform_create(serializer)
+        if generate_title:
+            # Number new chats by id rather than counting every row on insert
+            chat = serializer.instance
+            chat.title = f"New Chat {chat.id}"
+            chat.save(update_fields=['title'])
         
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
     @action(detail=True, methods=['post'], url_path='send_message', url_name='send_message')
     def send_message(self, request, pk=None):
+        from langchain.schema import HumanMessage
+        from .evaluation import schedule_evaluation
+        from .llm import LLMUnavailable, chat_model, request_deadline
+        from .memory import build_chat_memory
+
         try:
             chat = self.get_object()
             user_message = request.data.get('message')
@@ -85,56 +302,78 @@ class ChatViewSet(viewsets.ModelViewSet):
                 )
 
             # Create user message
-            user_msg = Message.objects.create(
-                chat=chat,
-                content=user_message,
-                is_user=True
-            )
+            with stage("db"):
+                user_msg = Message.objects.create(
+                    chat=chat,
+                    content=user_message,
+                    is_user=True
+                )
 
             try:
-                # Get relevant documents using RAG if they exist
-                documents = Document.objects.all()
-                if documents.exists():
-                    try:
-                        # Get document contents
+                cache_match = None
+                result = None
+                # LLM calls wait for capacity no longer than the request deadline
+                with request_deadline():
+                    with stage("memory"):
+                        memory = build_chat_memory(chat, exclude_message_id=user_msg.id)
+                    # Get relevant documents using RAG if they exist
+                    documents = Document.objects.all()
+                    if documents.exists():
+                        try:
+                            # Get document contents
 
                         
-                        # Use rag_with_internet_search function
-                        result = rag_with_internet_search(user_message)
+                            # Use rag_with_internet_search function
+                            result, cache_match = cached_rag_with_internet_search(
+                                user_message, memory, document_ids=chat.document_ids()
+                            )
                         
-                        assistant_message = result["answer"]
-                        sources = result.get("sources", [])
+                            assistant_message = result["answer"]
+                            sources = result.get("sources", [])
                         
-                    except Exception as e:
-                        logger.error(f"Error with RAG processing: {str(e)}")
-                        # Fallback to regular chat if RAG fails
-                        llm = ChatOpenAI(
-                            model_name="gpt-3.5-turbo",
-                            temperature=0.7,
-                            api_key=settings.OPENAI_API_KEY
+                        except LLMUnavailable:
+                            raise
+                        except Exception as e:
+                            logger.error(f"Error with RAG processing: {str(e)}")
+                            # Fallback to regular chat if RAG fails
+                            cache_match = None
+                            result = None
+                            llm = chat_model("gpt-3.5-turbo", temperature=0.7, api_key=settings.OPENAI_API_KEY)
+                            with stage("llm_fallback"):
+                                response = llm([HumanMessage(content=user_message)])
+                            assistant_message = response.content
+                            sources = []
+                    else:
+                        # If no documents, just use the base model
+                        result, cache_match = cached_rag_with_internet_search(
+                            user_message, memory, document_ids=chat.document_ids()
                         )
-                        response = llm([HumanMessage(content=user_message)])
-                        assistant_message = response.content
-                        sources = []
-                else:
-                    # If no documents, just use the base model
-                    result = rag_with_internet_search(user_message)
-                    assistant_message = result
-                    sources = []
+                        assistant_message = result["answer"]
+                        sources = result.get("sources", [])
 
                 # Create assistant message
-                assistant_msg = Message.objects.create(
-                    chat=chat,
-                    content=assistant_message,
-                    is_user=False
-                )
+                with stage("db"):
+                    assistant_msg = Message.objects.create(
+                        chat=chat,
+                        content=assistant_message,
+                        is_user=False
+                    )
+                    # Evaluate fresh RAG answers in the background instead of before replying
+                    if result is not None and cache_match is None:
+                        schedule_evaluation(assistant_msg, user_message, result.get("sources_text", ""))
 
                 return Response({
                     "user_message": MessageSerializer(user_msg).data,
                     "assistant_message": MessageSerializer(assistant_msg).data,
-                    "sources": sources
+                    "sources": sources,
+                    "cache": cache_match
                 })
 
+            except LLMUnavailable as e:
+                logger.warning(f"No LLM capacity for chat {chat.id}: {str(e)}")
+                user_msg.delete()
+                return llm_unavailable_response(e)
+
             except Exception as e:
                 logger.error(f"Error processing message: {str(e)}")
                 # Delete the user message if assistant message fails
@@ -148,4 +387,198 @@ class ChatViewSet(viewsets.ModelViewSet):
             return Response(
                 {"error": "Chat not found"},
                 status=status.HTTP_404_NOT_FOUND
-            )
\ No newline at end of file
+            )
+
+    @action(detail=True, methods=['post'], url_path='send_message_stream', url_name='send_message_stream',
+            renderer_classes=[JSONRenderer, EventStreamRenderer])
+    def send_message_stream(self, request, pk=None):
+        from .llm import LLMUnavailable, get_limiter
+
+        chat = self.get_object()
+        user_message = request.data.get('message')
+
+        if not user_message:
+            return Response(
+                {"error": "Message content is required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        # Once the stream has started it can only report errors as events; refuse up front instead
+        if get_limiter().saturated():
+            return llm_unavailable_response(LLMUnavailable("Too many LLM calls are queued"))
+
+        user_msg = Message.objects.create(
+            chat=chat,
+            content=user_message,
+            is_user=True
+        )
+
+        events = self._stream_message_events(chat, user_msg)
+        if isinstance(request._request, ASGIRequest):
+            events = iterate_in_thread(events)
+        response = StreamingHttpResponse(events, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Keep reverse proxies from buffering the event stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    @action(detail=True, methods=['get'], url_path='messages', url_name='messages')
+    def messages(self, request, pk=None):
+        chat = self.get_object()
+        messages = Message.objects.filter(chat=chat).select_related('evaluation')
+        paginator = MessageCursorPagination()
+        page = paginator.paginate_queryset(messages, request, view=self)
+        return paginator.get_paginated_response(MessageSerializer(page, many=True).data)
+
+    @action(detail=True, methods=['get'], url_path='evaluations', url_name='evaluations')
+    def evaluations(self, request, pk=None):
+        chat = self.get_object()
+        evaluations = MessageEvaluation.objects.filter(message__chat=chat).order_by('created_at')
+        return Response(MessageEvaluationSerializer(evaluations, many=True).data)
+
+    def _stream_message_events(self, chat, user_msg):
+        from .evaluation import schedule_evaluation
+        from .memory import build_chat_memory
+        from .rag_exp import stream_rag_with_internet_search
+
+        yield sse_event("user_message", MessageSerializer(user_msg).data)
+
+        answer = None
+        sources_text = ""
+        try:
+            with stage("memory"):
+                memory = build_chat_memory(chat, exclude_message_id=user_msg.id)
+            events = stream_rag_with_internet_search(
+                user_msg.content, memory=memory, document_ids=chat.document_ids()
+            )
+            for event, data in events:
+                if event == "error":
+                    raise RuntimeError(data)
+                if event == "answer":
+                    answer = data
+                if event == "sources":
+                    sources_text = data["sources_text"]
+                    data = data["sources"]
+                yield sse_event(event, data)
+
+            # Persist the assistant message once the whole answer has been streamed
+            with stage("db"):
+                assistant_msg = Message.objects.create(
+                    chat=chat,
+                    content=answer,
+                    is_user=False
+                )
+                evaluation = schedule_evaluation(assistant_msg, user_msg.content, sources_text)
+            yield sse_event("evaluation", MessageEvaluationSerializer(evaluation).data if evaluation else None)
+            yield sse_event("done", {"assistant_message": MessageSerializer(assistant_msg).data})
+        except Exception as e:
+            logger.error(f"Error streaming message: {str(e)}")
+            user_msg.delete()
+            yield sse_event("error", {"error": f"Error processing message: {str(e)}"})
+
+
+async def send_message_async(request, pk):
+    """Async counterpart of ``ChatViewSet.send_message`` for ASGI deployments.
+
+    While it waits on OpenAI, FAISS and Tavily the request holds no worker thread,
+    so one process can serve many chats at once.
+    """
+    from langchain.schema import HumanMessage
+    from .evaluation import schedule_evaluation
+    from .llm import LLMUnavailable, chat_model, request_deadline
+    from .memory import build_chat_memory
+
+    if request.method != 'POST':
+        return JsonResponse({"error": "Method not allowed"}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    chat = await Chat.objects.filter(pk=pk).afirst()
+    if chat is None:
+        return JsonResponse({"error": "Chat not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    try:
+        user_message = json.loads(request.body or b"{}").get('message')
+    except ValueError:
+        user_message = request.POST.get('message')
+
+    if not user_message:
+        return JsonResponse(
+            {"error": "Message content is required"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    with stage("db"):
+        user_msg = await Message.objects.acreate(
+            chat=chat,
+            content=user_message,
+            is_user=True
+        )
+
+    try:
+        cache_match = None
+        result = None
+        sources = []
+        # LLM calls wait for capacity no longer than the request deadline
+        with request_deadline():
+            try:
+                with stage("memory"):
+                    memory = await sync_to_async(build_chat_memory)(chat, exclude_message_id=user_msg.id)
+                document_ids = await sync_to_async(chat.document_ids)()
+                result, cache_match = await acached_rag_with_internet_search(
+                    user_message, memory, document_ids=document_ids
+                )
+                assistant_message = result["answer"]
+                sources = result.get("sources", [])
+            except LLMUnavailable:
+                raise
+            except Exception as e:
+                logger.error(f"Error with RAG processing: {str(e)}")
+                # Fallback to regular chat if RAG fails
+                llm = chat_model("gpt-3.5-turbo", temperature=0.7, api_key=settings.OPENAI_API_KEY)
+                with stage("llm_fallback"):
+                    response = await llm.ainvoke([HumanMessage(content=user_message)])
+                assistant_message = response.content
+                result = None
+
+        with stage("db"):
+            assistant_msg = await Message.objects.acreate(
+                chat=chat,
+                content=assistant_message,
+                is_user=False
+            )
+            if result is not None and cache_match is None:
+                await sync_to_async(schedule_evaluation)(assistant_msg, user_message, result.get("sources_text", ""))
+
+        # Serializing reads the evaluation relation, which is a sync ORM query
+        @sync_to_async
+        def serialize(msg):
+            return MessageSerializer(msg).data
+
+        return JsonResponse({
+            "user_message": await serialize(user_msg),
+            "assistant_message": await serialize(assistant_msg),
+            "sources": sources,
+            "cache": cache_match
+        })
+
+    except LLMUnavailable as e:
+        logger.warning(f"No LLM capacity for chat {chat.id}: {str(e)}")
+        await user_msg.adelete()
+        return llm_unavailable_response(e, JsonResponse)
+
+    except Exception as e:
+        logger.error(f"Error processing message: {str(e)}")
+        # Delete the user message if assistant message fails
+        await user_msg.adelete()
+        return JsonResponse(
+            {"error": f"Error processing message: {str(e)}"},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+# Like the DRF views, this endpoint is not protected by CSRF; Django 4.2's
+# csrf_exempt decorator does not support coroutine views, so set the flag directly.
+send_message_async.csrf_exempt = True
+
+
+def metrics(request):
+    """Prometheus text exposition of the stage, request, token and tool-call histograms."""
+    return HttpResponse(REGISTRY.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,95 @@
+import importlib
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+from .tracing import WARMUP_DURATION
+
+logger = logging.getLogger(__name__)
+
+# Modules views.py imports on first use; importing them pulls in LangChain, FAISS and PyMuPDF
+PIPELINE_MODULES = (
+    "chat_api.rag_exp",
+    "chat_api.evaluation",
+    "chat_api.memory",
+    "chat_api.ingestion",
+    "chat_api.indexing",
+)
+
+
+def process_age() -> Optional[float]:
+    """Seconds since this process was started, where ``/proc`` tells."""
+    try:
+        with open("/proc/self/stat") as stat:
+            # Fields after the parenthesised command name; the 20th is the start time in clock ticks
+            started = int(stat.read().rsplit(")", 1)[1].split()[19]) / os.sysconf("SC_CLK_TCK")
+        with open("/proc/uptime") as uptime:
+            return float(uptime.read().split()[0]) - started
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def import_pipeline():
+    for name in PIPELINE_MODULES:
+        importlib.import_module(name)
+
+
+def create_clients():
+    from .answer_cache import get_answer_cache
+    from .engine import get_engine
+    from .tokens import count_tokens
+    get_engine()
+    get_answer_cache()
+    count_tokens("warm-up")  # loads the tokenizer
+
+
+def load_index():
+    from .engine import get_engine
+    get_engine().state
+
+
+def open_shards():
+    from .engine import get_engine
+    # The collection of all documents, as searched by chats not scoped to particular documents
+    get_engine().shards()
+
+
+WARMUP_STEPS = (
+    ("imports", import_pipeline),
+    ("clients", create_clients),
+    ("index", load_index),
+    ("shards", open_shards),
+)
+
+
+def warmup() -> Dict[str, float]:
+    """Do now what the first chat requests of a worker would otherwise wait for.
+
+    Returns the seconds each step took, their ``total``, and ``boot``: the
+    time from process start until now, interpreter and Django setup included.
+    A failing step is logged and skipped, so a worker without an index still
+    starts.
+    """
+    timings = {}
+    started = time.perf_counter()
+    for name, step in WARMUP_STEPS:
+        step_started = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            logger.error(f"Warm-up step {name} failed: {str(e)}")
+        timings[name] = time.perf_counter() - step_started
+        WARMUP_DURATION.observe(timings[name], step=name)
+    timings["total"] = time.perf_counter() - started
+    WARMUP_DURATION.observe(timings["total"], step="total")
+    boot = process_age()
+    if boot is not None:
+        timings["boot"] = boot
+        WARMUP_DURATION.observe(boot, step="boot")
+    logger.info(
+        f"Warmed up in {timings['total']:.2f}s ("
+        + ", ".join(f"{name} {timings[name]:.2f}s" for name, _ in WARMUP_STEPS) + ")"
+        + (f"; ready {boot:.2f}s after process start" if boot is not None else "")
+    )
+    return timings
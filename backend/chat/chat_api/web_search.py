@@ -0,0 +1,227 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from langchain_core.tools import BaseTool
+
+from .lexical import tokenize
+from .tracing import stage
+
+logger = logging.getLogger(__name__)
+
+UNAVAILABLE_MESSAGE = "Web search is temporarily unavailable; answer from the documents."
+
+
+def search_key(query: str) -> str:
+    return " ".join(token.lower() for token in tokenize(query))
+
+
+class SearchCache:
+    """On-disk cache of web search results, keyed by normalized query, expiring after ``ttl`` seconds."""
+
+    def __init__(self, path: str, ttl: float = 6 * 3600):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS search_results ("
+            "key TEXT PRIMARY KEY, results TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT results FROM search_results WHERE key = ? AND created_at > ?", (key, time.time() - self.ttl)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, results: Any):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO search_results (key, results, created_at) VALUES (?, ?, ?)",
+                (key, json.dumps(results), time.time()),
+            )
+            self._conn.execute("DELETE FROM search_results WHERE created_at <= ?", (time.time() - self.ttl,))
+            self._conn.commit()
+
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive failures and stays open for ``cooldown`` seconds.
+
+    After the cool-down one trial call is let through; its outcome closes the
+    breaker again or restarts the cool-down.
+    """
+
+    def __init__(self, failure_threshold: int = 3, cooldown: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._trial_running or time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def release_trial(self):
+        """Give up a trial call that ended without an outcome (it was cancelled); the next call may try again."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning(f"Web search failed {self.failures} times; skipping it for {self.cooldown:.0f}s")
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+
+class StubSearchBackend(BaseTool):
+    """Offline stand-in for the Tavily search tool, for tests and benchmarks."""
+
+    name: str = "tavily_search_results_json"
+    description: str = "Offline stand-in for the Tavily search tool."
+    latency: float = 0.0
+
+    def _run(self, query: str, run_manager=None) -> List[Dict[str, str]]:
+        if self.latency:
+            time.sleep(self.latency)
+        return [{"url": "https://example.com/result", "content": f"Web result for {query}"}]
+
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="web-search")
+
+
+class WebSearchTool(BaseTool):
+    """Web search with a result cache, a per-call deadline and a circuit breaker.
+
+    A search that times out, fails, or is skipped while the breaker is open
+    returns a short notice instead of raising, so the agent carries on with the
+    documents rather than stalling the request.
+    """
+
+    name: str = "tavily_search_results_json"
+    description: str = "A search engine for current events and facts not found in the documents."
+    backend: Any
+    cache: Optional[Any] = None
+    timeout: float = 8.0
+    breaker: Any
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _cached(self, query: str):
+        if self.cache is None:
+            return None
+        return self.cache.get(search_key(query))
+
+    def _store(self, query: str, results):
+        self.breaker.record_success()
+        if self.cache is not None:
+            self.cache.put(search_key(query), results)
+
+    def _failed(self, query: str, error) -> str:
+        self.breaker.record_failure()
+        logger.error(f"Web search for {query!r} failed: {error}")
+        return UNAVAILABLE_MESSAGE
+
+    def _run(self, query: str, run_manager=None):
+        cached = self._cached(query)
+        if cached is not None:
+            return cached
+        if not self.breaker.allow():
+            return UNAVAILABLE_MESSAGE
+        with stage("web_search"):
+            future = _executor.submit(self.backend.invoke, query)
+            try:
+                results = future.result(timeout=self.timeout)
+            except FutureTimeoutError:
+                # The call keeps its worker thread until it returns, but nobody waits on it
+                return self._failed(query, f"no response within {self.timeout:.1f}s")
+            except Exception as e:
+                return self._failed(query, e)
+        if isinstance(results, str):
+            # TavilySearchResults reports API errors as a string instead of raising
+            return self._failed(query, results)
+        self._store(query, results)
+        return results
+
+    async def _arun(self, query: str, run_manager=None):
+        cached = self._cached(query)
+        if cached is not None:
+            return cached
+        if not self.breaker.allow():
+            return UNAVAILABLE_MESSAGE
+        with stage("web_search"):
+            try:
+                results = await asyncio.wait_for(self.backend.ainvoke(query), timeout=self.timeout)
+            except asyncio.TimeoutError:
+                return self._failed(query, f"no response within {self.timeout:.1f}s")
+            except asyncio.CancelledError:
+                # A prefetch nobody used, or a client that went away; says nothing about the backend
+                self.breaker.release_trial()
+                raise
+            except Exception as e:
+                return self._failed(query, e)
+        if isinstance(results, str):
+            # TavilySearchResults reports API errors as a string instead of raising
+            return self._failed(query, results)
+        self._store(query, results)
+        return results
+
+
+def create_search_backend(name: Optional[str] = None) -> BaseTool:
+    name = name or getattr(settings, "WEB_SEARCH_BACKEND", "tavily")
+    if name == "stub":
+        return StubSearchBackend()
+    if name == "tavily":
+        from langchain_community.tools.tavily_search import TavilySearchResults
+        return TavilySearchResults(max_results=getattr(settings, "WEB_SEARCH_MAX_RESULTS", 2))
+    raise ValueError(f"Unknown WEB_SEARCH_BACKEND {name!r}; expected 'tavily' or 'stub'")
+
+
+def create_web_search(backend: Optional[BaseTool] = None, cached: bool = True) -> WebSearchTool:
+    cache = None
+    if cached and getattr(settings, "WEB_SEARCH_CACHE_PATH", None):
+        cache = SearchCache(settings.WEB_SEARCH_CACHE_PATH, ttl=getattr(settings, "WEB_SEARCH_CACHE_TTL", 6 * 3600))
+    return WebSearchTool(
+        backend=backend or create_search_backend(),
+        cache=cache,
+        timeout=getattr(settings, "WEB_SEARCH_TIMEOUT", 8.0),
+        breaker=CircuitBreaker(
+            failure_threshold=getattr(settings, "WEB_SEARCH_FAILURE_THRESHOLD", 3),
+            cooldown=getattr(settings, "WEB_SEARCH_COOLDOWN", 60.0),
+        ),
+    )
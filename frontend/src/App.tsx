@@ -21,6 +21,8 @@ interface Chat {
 
 function App() {
   const [chats, setChats] = useState<Chat[]>([]);
+  // Cursor of the next (older) page of chats, null once all are loaded
+  const [nextChatsUrl, setNextChatsUrl] = useState<string | null>(null);
   const [currentChat, setCurrentChat] = useState<Chat | null>(null);
   const [message, setMessage] = useState('');
   const [isLoading, setIsLoading] = useState(false);
@@ -33,12 +35,20 @@ function App() {
     fetchChats();
   }, []);
 
-  const fetchChats = async () => {
+  const fetchChats = async (url: string | null = null) => {
     try {
       setIsLoading(true);
       setError(null);
-      const response = await axios.get('/chats/');
-      setChats(response.data);
+      // Chats are paginated newest first; ``url`` is the ``next`` link of the page before
+      const response = await axios.get(url ?? '/chats/');
+      // The list is a compact summary; messages are loaded per chat on selection
+      const page: Chat[] = response.data.results.map((chat: Chat) => ({ ...chat, messages: [] }));
+      setChats(prevChats => {
+        if (!url) return page;
+        const loaded = new Set(prevChats.map(chat => chat.id));
+        return [...prevChats, ...page.filter(chat => !loaded.has(chat.id))];
+      });
+      setNextChatsUrl(response.data.next);
     } catch (err) {
       console.error('Error fetching chats:', err);
       setError('Failed to fetch chats. Please try again.');
@@ -54,8 +64,8 @@ function App() {
       const response = await axios.post('/chats/', {
         title: `New Chat ${chats.length + 1}`
       });
-      const newChat = response.data;
-      setChats(prevChats => [...prevChats, newChat]);
+      const newChat = { ...response.data, messages: [] };
+      setChats(prevChats => [newChat, ...prevChats]);
       setCurrentChat(newChat);
     } catch (err) {
       console.error('Error creating chat:', err);
@@ -65,6 +75,19 @@ function App() {
     }
   };
 
+  const selectChat = async (chat: Chat) => {
+    try {
+      setError(null);
+      const response = await axios.get(`/chats/${chat.id}/messages/`);
+      // History is paginated newest first
+      const messages = [...response.data.results].reverse();
+      setCurrentChat({ ...chat, messages });
+    } catch (err) {
+      console.error('Error fetching messages:', err);
+      setError('Failed to fetch messages. Please try again.');
+    }
+  };
+
   const sendMessage = async (e: React.FormEvent) => {
     e.preventDefault();
     if (!message.trim() || !currentChat || isLoading) return;
@@ -134,7 +157,7 @@ function App() {
           {chats.map((chat) => (
             <div
               key={chat.id}
-              onClick={() => setCurrentChat(chat)}
+              onClick={() => selectChat(chat)}
               className={`p-4 cursor-pointer hover:bg-gray-100 ${
                 currentChat?.id === chat.id ? 'bg-gray-100' : ''
               }`}
@@ -142,6 +165,15 @@ function App() {
               {chat.title}
             </div>
           ))}
+          {nextChatsUrl && (
+            <button
+              onClick={() => fetchChats(nextChatsUrl)}
+              disabled={isLoading}
+              className="w-full p-4 text-sm text-blue-500 hover:bg-gray-100 disabled:text-gray-400"
+            >
+              {isLoading ? 'Loading...' : 'Load more'}
+            </button>
+          )}
         </div>
       </div>
 